@@ -0,0 +1,138 @@
+try:
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtCore import *
+
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from libs.pascal_voc_io import PascalVocReader, XML_EXT
+
+AnnotationSummary = namedtuple('AnnotationSummary', 'mtime objects verified edited')
+
+
+def summarizeAnnotation(xmlPath):
+    """Count the objects and edited contours of an annotation file and read
+    its verified flag without decoding any contour."""
+    mtime = os.path.getmtime(xmlPath)
+    reader = PascalVocReader(xmlPath, lazy=True)
+    objects, edited = 0, 0
+    for label, points, lineColor, fillColor, contour, confidence, contourEdited, maskLabel in reader.iterShapes(decodeContours=False):
+        objects += 1
+        edited += contourEdited
+    return AnnotationSummary(mtime, objects, reader.verified, edited)
+
+
+class AnnotationIndex(QObject):
+    """Summary of the annotation file of every image of the opened folder.
+
+    Files are parsed in parallel in the background. When a watched
+    directory changes, the mtimes of its files are compared in the
+    background as well and files that differ are parsed again. `changed` is emitted
+    with the image path whenever a summary was updated.
+
+    `annotationPath(imagePath)` returns the annotation file of an image,
+    by default the XML file next to it.
+    """
+    changed = pyqtSignal(str)
+    _parsed = pyqtSignal(str)
+
+    def __init__(self, annotationPath=None, parent=None):
+        super(AnnotationIndex, self).__init__(parent)
+        self.annotationPath = annotationPath or (lambda imagePath: os.path.splitext(imagePath)[0] + XML_EXT)
+        self._executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self._byDir = {}
+        self._futures = []
+        self._pendingDirs = set()
+        self._generation = 0
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self.directoryChanged)
+        # results are handed to the GUI thread through a queued signal
+        self._parsed.connect(self.changed)
+
+    def setImages(self, imagePaths):
+        self._generation += 1
+        with self._lock:
+            self._summaries = {}
+            self._pendingDirs = set()
+        self._byDir = {}
+        # watched are the directories of the annotation files
+        for imagePath in imagePaths:
+            self._byDir.setdefault(os.path.dirname(self.annotationPath(imagePath)), []).append(imagePath)
+        if self._watcher.directories():
+            self._watcher.removePaths(self._watcher.directories())
+        if self._byDir:
+            self._watcher.addPaths(list(self._byDir))
+        self._futures = [self._executor.submit(self._summarize, p, self._generation) for p in imagePaths]
+
+    def addImages(self, imagePaths):
+        """Index further images of the folder, e.g. while it is scanned."""
+        added = []
+        for imagePath in imagePaths:
+            dirPath = os.path.dirname(self.annotationPath(imagePath))
+            if dirPath not in self._byDir:
+                added.append(dirPath)
+            self._byDir.setdefault(dirPath, []).append(imagePath)
+        if added:
+            self._watcher.addPaths(added)
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.extend(self._executor.submit(self._summarize, p, self._generation) for p in imagePaths)
+
+    def _summarize(self, imagePath, generation):
+        xmlPath = self.annotationPath(imagePath)
+        try:
+            summary = summarizeAnnotation(xmlPath)
+        except FileNotFoundError:
+            summary = None
+        except Exception as e:
+            logging.error('Reading {0} failed: {1}'.format(xmlPath, e))
+            summary = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._summaries[imagePath] = summary
+        self._parsed.emit(imagePath)
+
+    def directoryChanged(self, dirPath):
+        # every save touches the directory a few times, the files are
+        # compared in the background and only once per pending change
+        imagePaths = self._byDir.get(dirPath)
+        if not imagePaths:
+            return
+        with self._lock:
+            if dirPath in self._pendingDirs:
+                return
+            self._pendingDirs.add(dirPath)
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.append(self._executor.submit(self._rescan, dirPath, list(imagePaths), self._generation))
+
+    def _rescan(self, dirPath, imagePaths, generation):
+        with self._lock:
+            self._pendingDirs.discard(dirPath)
+        for imagePath in imagePaths:
+            if generation != self._generation:
+                return
+            xmlPath = self.annotationPath(imagePath)
+            try:
+                mtime = os.path.getmtime(xmlPath)
+            except OSError:
+                mtime = None
+            summary = self.get(imagePath)
+            if (summary.mtime if summary is not None else None) != mtime:
+                self._summarize(imagePath, generation)
+
+    def wait(self):
+        """Block until every submitted file is parsed."""
+        wait(self._futures)
+        self._futures = [f for f in self._futures if not f.done()]
+
+    def get(self, imagePath):
+        """Return the AnnotationSummary of an image, None if it has no
+        annotation file or was not parsed yet."""
+        with self._lock:
+            return self._summaries.get(imagePath)
@@ -5,7 +5,7 @@ import numpy as np
 
 
 class BoundBox:
-    def __init__(self, xmin, ymin, xmax, ymax, c=None, classes=None, contour=None, confidence=0):
+    def __init__(self, xmin, ymin, xmax, ymax, c=None, classes=None, contour=None, confidence=0, maskLabel=None):
         self.xmin = xmin
         self.ymin = ymin
         self.xmax = xmax
@@ -15,6 +15,7 @@ class BoundBox:
         self.classes = classes
         self.contour = contour
         self.confidence = confidence
+        self.maskLabel = maskLabel
         self.label = -1
         self.score = -1
 
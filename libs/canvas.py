@@ -10,8 +10,10 @@ except ImportError:
 #from PyQt4.QtOpenGL import *
 
 from libs.shape import Shape
+from libs.spatialIndex import GridIndex
+from libs.shapeRenderer import ShapeRenderer
+from libs.tilePyramid import TilePyramid
 from libs.lib import distance
-import numpy as np
 import math
 
 CURSOR_DEFAULT = Qt.ArrowCursor
@@ -30,7 +32,10 @@ class Canvas(QWidget):
     selectionChanged = pyqtSignal(bool)
     shapeMoved = pyqtSignal()
     drawingPolygon = pyqtSignal(bool)
-    saveFileSignal = pyqtSignal()
+    saveFileSignal = pyqtSignal(object)
+    # an edit of the shapes is complete, True if it may be merged with the
+    # previous one for undo
+    editFinished = pyqtSignal(bool)
 
     CREATE, EDIT = list(range(2))
 
@@ -42,6 +47,10 @@ class Canvas(QWidget):
         self.mode = self.EDIT
         self.contourMode = False
         self.shapes = []
+        # bounds of all shapes, so hit tests only look at shapes near the cursor
+        self.index = GridIndex()
+        # draws the shapes of the static layer in batches
+        self.renderer = ShapeRenderer()
         self.current = None
         self.selectedShape = None  # save the selected shape here
         self.selectedShapeCopy = None
@@ -57,7 +66,8 @@ class Canvas(QWidget):
         self.prevPoint = QPointF()
         self.offsets = QPointF(), QPointF()
         self.scale = 1.0
-        self.pixmap = QPixmap()
+        # the image, drawn from a tile pyramid chosen by the zoom level
+        self.pixmap = TilePyramid()
         self.visible = {}
         self._hideBackround = False
         self.hideBackround = False
@@ -72,6 +82,28 @@ class Canvas(QWidget):
         self.setFocusPolicy(Qt.WheelFocus)
         self.verified = False
         self.showContourOverlay = False
+        self._layer = None
+        self._layerKey = None
+        # While the user drags, pans or zooms, frames are drawn with fast
+        # render hints; once input paused for a moment the canvas is drawn
+        # once more in full quality. Only panning and zooming rebuild the
+        # static layer, from a coarser pyramid level; a shape drag keeps it.
+        self.interacting = False
+        self.navigating = False
+        self.idleTimer = QTimer(self)
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.setInterval(150)
+        self.idleTimer.timeout.connect(self.endInteraction)
+
+    def beginInteraction(self, navigate=False):
+        self.interacting = True
+        self.navigating = self.navigating or navigate
+        self.idleTimer.start()
+
+    def endInteraction(self):
+        self.interacting = False
+        self.navigating = False
+        self.update()
 
     def setDrawingColor(self, qColor):
         self.drawingLineColor = qColor
@@ -101,7 +133,7 @@ class Canvas(QWidget):
             self.unHighlight()
             self.deSelectShape()
         self.prevPoint = QPointF()
-        self.repaint()
+        self.update()
 
     def unHighlight(self):
         if self.hShape:
@@ -143,37 +175,48 @@ class Canvas(QWidget):
                 self.current.highlightClear()
             else:
                 self.prevPoint = pos
-            self.repaint()
+            # the crosshair spans the whole image
+            self.update()
             return
 
+        if ev.buttons() & (Qt.LeftButton | Qt.RightButton):
+            self.beginInteraction()
+
         # Polygon copy moving.
         if not self.contourMode:
             if Qt.RightButton & ev.buttons():
                 if self.selectedShapeCopy and self.prevPoint:
                     self.overrideCursor(CURSOR_MOVE)
+                    dirty = self.shapeRect(self.selectedShapeCopy)
                     self.boundedMoveShape(self.selectedShapeCopy, pos)
-                    self.repaint()
+                    self.update(dirty)
+                    self.updateShapes(self.selectedShapeCopy)
                 elif self.selectedShape:
                     self.selectedShapeCopy = self.selectedShape.copy()
-                    self.repaint()
+                    self.updateShapes(self.selectedShapeCopy)
                 return
 
         # Polygon/Vertex moving.
         if not self.contourMode:
             if Qt.LeftButton & ev.buttons():
                 if self.selectedVertex():
+                    dirty = self.shapeRect(self.hShape)
                     self.boundedMoveVertex(pos)
                     self.shapeMoved.emit()
-                    self.repaint()
+                    self.update(dirty)
+                    self.updateShapes(self.hShape)
                 elif self.selectedShape and self.prevPoint:
                     self.overrideCursor(CURSOR_MOVE)
+                    dirty = self.shapeRect(self.selectedShape)
                     self.boundedMoveShape(self.selectedShape, pos)
                     self.shapeMoved.emit()
                     # self.selectedShape.contour_points = list()
-                    self.repaint()
+                    self.update(dirty)
+                    self.updateShapes(self.selectedShape)
                 return
         
         if self.contourMode and self.selectedShape:
+            dirty = self.shapeRect(self.selectedShape)
             if Qt.LeftButton & ev.buttons():
                 self.overrideCursor(CURSOR_MOVE)
                 if self.cntOldidx is not None:
@@ -184,24 +227,19 @@ class Canvas(QWidget):
                     # print(delta_y, delta_x)
                     mods = ev.modifiers()
                     if Qt.ControlModifier == int(mods):
-                        for i, p in enumerate(self.selectedShape.contour_points):
-                            self.selectedShape.contour_points[i] = (p[0] + delta_y, p[1] + delta_x)
+                        self.selectedShape.translateContour(delta_y, delta_x)
                     else:
-                        for i in range(self.cntOldidx-3, self.cntOldidx+4, 1):
-                            i %= len(self.selectedShape.contour_points)
-                            p = self.selectedShape.contour_points[i]
-                            d = np.sqrt((p[0]-cntOld[0])**2 + (p[1]-cntOld[1])**2)
-                            f = 1/(1 + 1.8 * d) 
-                            self.selectedShape.contour_points[i] = (p[0] + delta_y * f, p[1] + delta_x * f)
-                        # print(p, f, self.selectedShape.contour_points[i])
-            self.repaint()
+                        self.selectedShape.deformContour(self.cntOldidx, delta_y, delta_x, 1.8)
+            self.update(dirty)
+            self.updateShapes(self.selectedShape)
             return
         # Just hovering over the canvas, 2 posibilities:
         # - Highlight shapes
         # - Highlight vertex
         # Update shape/vertex fill and tooltip value accordingly.
         # self.setToolTip('')
-        for shape in reversed([s for s in self.shapes if self.isVisible(s)]):
+        previous = self.hShape
+        for shape in [s for s in self.index.candidates(pos, self.epsilon) if self.isVisible(s)]:
             # Look for a nearby vertex to highlight. If that fails,
             # check if we happen to be inside a shape.
             index = shape.nearestVertex(pos, self.epsilon)
@@ -213,7 +251,7 @@ class Canvas(QWidget):
                 self.overrideCursor(CURSOR_POINT)
                 # self.setToolTip("Click & drag to move point")
                 # self.setStatusTip(self.toolTip())
-                self.update()
+                self.updateShapes(previous, shape)
                 break
             elif shape.containsPoint(pos):
                 if self.selectedVertex():
@@ -222,12 +260,12 @@ class Canvas(QWidget):
                 # self.setToolTip("Click & drag to move shape '%s'" % shape.label)
                 # self.setStatusTip(self.toolTip())
                 self.overrideCursor(CURSOR_GRAB)
-                self.update()
+                self.updateShapes(previous, shape)
                 break
         else:  # Nothing found, clear highlights, reset state.
             if self.hShape:
                 self.hShape.highlightClear()
-                self.update()
+                self.updateShapes(self.hShape)
             self.hVertex, self.hShape = None, None
             self.overrideCursor(CURSOR_DEFAULT)
 
@@ -240,30 +278,14 @@ class Canvas(QWidget):
             elif self.contourMode and self.showContourOverlay:
                 self.unHighlight()
                 xmin, ymin = int(self.selectedShape.points[0].x()), int(self.selectedShape.points[0].y())
-                punktmenge = list()
-                begin = pos.y() - ymin, pos.x() - xmin
-                d_s = list()
-                for p in self.selectedShape.contour_points: 
-                    d = np.sqrt((p[0] - begin[0])**2 + (p[1] - begin[1])**2)
-                    # print(d)
-                    if d < 10:
-                        punktmenge.append(p)
-                        d_s.append(d)
-                try:
-                    nearest = punktmenge[np.argmin(d_s)]
-                    self.cntOldidx = self.selectedShape.contour_points.index(nearest)
-                    # sprint(nearest, self.cntOldidx)
-                except Exception as e:
-                    self.cntOldidx = None
-                    # print(e)
+                self.cntOldidx = self.selectedShape.nearestContourPoint(pos.y() - ymin, pos.x() - xmin, 10)
             else:
+                # selecting updates the old and the new selection
                 self.selectShapePoint(pos)
                 self.prevPoint = pos
-                self.repaint()
         elif ev.button() == Qt.RightButton and self.editing():
             self.selectShapePoint(pos)
             self.prevPoint = pos
-            self.repaint()
 
     def mouseReleaseEvent(self, ev):
         pos = self.transformPos(ev.pos())
@@ -273,10 +295,12 @@ class Canvas(QWidget):
             if not menu.exec_(self.mapToGlobal(ev.pos()))\
                and self.selectedShapeCopy:
                 # Cancel the move by deleting the shadow copy.
+                dirty = self.shapeRect(self.selectedShapeCopy)
                 self.selectedShapeCopy = None
-                self.repaint()
+                self.update(dirty)
 
         elif ev.button() == Qt.LeftButton and self.selectedShape:
+            dirty = self.shapeRect(self.selectedShape)
             if self.contourMode and self.showContourOverlay:
                 # print('MouseReleaseEvent from contourMode')
                 # print(pos)
@@ -286,19 +310,15 @@ class Canvas(QWidget):
                     cntNew = int(pos.y() - shapeOrigin.y()), int(pos.x() - shapeOrigin.x())
                     delta_y, delta_x = cntNew[0] - cntOld[0], cntNew[1] - cntOld[1]
                     # print(delta_y, delta_x)
-                    for i in range(self.cntOldidx-3, self.cntOldidx+4, 1):
-                        i %= len(self.selectedShape.contour_points)
-                        p = self.selectedShape.contour_points[i]
-                        d = np.sqrt((p[0]-cntOld[0])**2 + (p[1]-cntOld[1])**2)
-                        f = 1/(1 + 1.4 * d) 
-                        self.selectedShape.contour_points[i] = (p[0] + delta_y * f, p[1] + delta_x * f)
-                        # print(p, f, self.selectedShape.contour_points[i])
-            self.repaint()
+                    self.selectedShape.deformContour(self.cntOldidx, delta_y, delta_x, 1.4)
+            self.update(dirty)
+            self.updateShapes(self.selectedShape)
 
             if self.selectedVertex():
                 self.overrideCursor(CURSOR_POINT)
             else:
                 self.overrideCursor(CURSOR_GRAB)
+            self.editFinished.emit(False)
         elif ev.button() == Qt.LeftButton:
             pos = self.transformPos(ev.pos())
             if self.drawing():
@@ -311,11 +331,16 @@ class Canvas(QWidget):
         #del shape.line_color
         if copy:
             self.shapes.append(shape)
+            self.index.insert(shape)
             self.selectedShape.selected = False
+            self.updateShapes(self.selectedShape, shape)
             self.selectedShape = shape
-            self.repaint()
         else:
+            dirty = self.shapeRect(self.selectedShape)
             self.selectedShape.points = [p for p in shape.points]
+            self.index.update(self.selectedShape)
+            self.update(dirty)
+            self.updateShapes(self.selectedShape)
         self.selectedShapeCopy = None
 
     def hideBackroundShapes(self, value):
@@ -324,7 +349,7 @@ class Canvas(QWidget):
             # Only hide other shapes if there is a current selection.
             # Otherwise the user will not be able to select a shape.
             self.setHiding(True)
-            self.repaint()
+            self.update()
 
     def handleDrawing(self, pos):
         if self.current and self.current.reachMaxPoints() is False:
@@ -367,7 +392,10 @@ class Canvas(QWidget):
         self.selectionChanged.emit(True)
         # print(shape.points)
         # print(shape.contour_points)
-        self.update()
+        if self._hideBackround:
+            self.update()
+        else:
+            self.updateShapes(shape)
 
     def selectShapePoint(self, point):
         """Select the first shape created which contains this point."""
@@ -377,7 +405,7 @@ class Canvas(QWidget):
             shape.highlightVertex(index, shape.MOVE_VERTEX)
             self.selectShape(shape)
             return
-        for shape in reversed(self.shapes):
+        for shape in self.index.candidates(point):
             if self.isVisible(shape) and shape.containsPoint(point):
                 self.selectShape(shape)
                 self.calculateOffsets(shape, point)
@@ -412,6 +440,7 @@ class Canvas(QWidget):
             rshift = QPointF(0, shiftPos.y())
         shape.moveVertexBy(rindex, rshift)
         shape.moveVertexBy(lindex, lshift)
+        self.index.update(shape)
 
     def boundedMoveShape(self, shape, pos):
         if self.outOfPixmap(pos):
@@ -431,17 +460,23 @@ class Canvas(QWidget):
         dp = pos - self.prevPoint
         if dp:
             shape.moveBy(dp)
+            if shape in self.index:
+                self.index.update(shape)
             self.prevPoint = pos
             return True
         return False
 
     def deSelectShape(self):
         if self.selectedShape and not self.contourMode:
-            self.selectedShape.selected = False
+            shape = self.selectedShape
+            shape.selected = False
             self.selectedShape = None
+            if self._hideBackround:
+                self.update()
+            else:
+                self.updateShapes(shape)
             self.setHiding(False)
             self.selectionChanged.emit(False)
-            self.update()
 
     def deleteSelected(self):
         if self.selectedShape and not self.contourMode:
@@ -449,10 +484,11 @@ class Canvas(QWidget):
             if self.selectedShape in self.shapes:
                 print('Box wurde gelöscht')
                 self.shapes.remove(self.selectedShape)
+                self.index.remove(self.selectedShape)
             else:
                 print('Zu löschen Box wurde nicht gefunden {0}{1}{2}{3}\n'.format(xmin, xmax, ymin, ymax))
             self.selectedShape = None
-            self.update()
+            self.updateShapes(shape)
             return shape
 
     def copySelectedShape(self):
@@ -460,6 +496,7 @@ class Canvas(QWidget):
             shape = self.selectedShape.copy()
             self.deSelectShape()
             self.shapes.append(shape)
+            self.index.insert(shape)
             shape.selected = True
             self.selectedShape = shape
             self.boundedShiftShape(shape)
@@ -479,19 +516,19 @@ class Canvas(QWidget):
         if not self.pixmap:
             return super(Canvas, self).paintEvent(event)
 
+        Shape.scale = self.scale
+        visible = self.visibleRect()
+        layer = self.staticLayer(visible)
+
         p = self._painter
         p.begin(self)
-        p.setRenderHint(QPainter.Antialiasing)
-        p.setRenderHint(QPainter.HighQualityAntialiasing)
-        p.setRenderHint(QPainter.SmoothPixmapTransform)
-
-        p.scale(self.scale, self.scale)
-        p.translate(self.offsetToCenter())
-
-        p.drawPixmap(0, 0, self.pixmap)
-        Shape.scale = self.scale
-        for shape in self.shapes:
-            if (shape.selected or not self._hideBackround) and self.isVisible(shape):
+        # image, resting shapes and contours come from the cached layer,
+        # only the selected and the hovered shape are painted every frame
+        p.drawPixmap(visible.topLeft(), layer)
+        self.setupPainter(p)
+        for shape in (self.selectedShape, self.hShape):
+            if shape is not None and shape in self.index and self.isVisible(shape) \
+                    and (shape.selected or not self._hideBackround):
                 shape.fill = shape.selected or shape == self.hShape
                 shape.paint(p)
         if self.current:
@@ -526,28 +563,109 @@ class Canvas(QWidget):
             pal.setColor(self.backgroundRole(), QColor(232, 232, 232, 255))
             self.setPalette(pal)
 
-        if self.showContourOverlay:
-            # print('showing contour with Qt')
+        if self.showContourOverlay and self.selectedShape:
             p.setPen(self.drawingContourColor)
-            brush = QBrush(QColor('transparent'))
-            p.setBrush(brush)
-            for shape in self.shapes:
-                p.drawPolygon(self.createPoly(shape))
-            if self.contourMode and self.selectedShape:
+            p.setBrush(QBrush(QColor('transparent')))
+            p.drawPolygon(self.createPoly(self.selectedShape))
+            if self.contourMode:
                 pen = QPen(QColor('black'))
                 pen.setWidth(4)
                 p.setPen(pen)
-                xmin, ymin = int(self.selectedShape.points[0].x()), int(self.selectedShape.points[0].y())
-                for i in self.selectedShape.contour_points:
-                    p.drawPoint(QPointF(i[1]+xmin, i[0]+ymin))
+                p.drawPoints(self.createPoly(self.selectedShape))
         p.end()
 
+    def setupPainter(self, p, fast=None):
+        quality = not (self.interacting if fast is None else fast)
+        p.setRenderHint(QPainter.Antialiasing, quality)
+        p.setRenderHint(QPainter.HighQualityAntialiasing, quality)
+        p.setRenderHint(QPainter.SmoothPixmapTransform, quality)
+        p.scale(self.scale, self.scale)
+        p.translate(self.offsetToCenter())
+
+    def visibleRect(self):
+        """Part of the canvas shown by the scroll area, in widget coordinates."""
+        visible = self.visibleRegion().boundingRect()
+        return visible if not visible.isEmpty() else self.rect()
+
+    def shapeRect(self, shape):
+        """Widget rectangle a shape paints into, with its contour, vertex
+        markers and confidence label."""
+        if shape is None or not shape.points or not self.pixmap:
+            return QRect()
+        rect = shape.boundingRect()
+        if len(shape.contour_points):
+            rect = rect.united(shape.contourBounds())
+        margin = self.paintMargin()
+        offset = self.offsetToCenter()
+        return QRectF((rect.x() - margin + offset.x()) * self.scale, (rect.y() - margin + offset.y()) * self.scale,
+                      (rect.width() + 2 * margin) * self.scale, (rect.height() + 2 * margin) * self.scale).toAlignedRect()
+
+    def updateShapes(self, *shapes):
+        """Schedule a repaint of the area of the given shapes, Qt merges
+        all requests of one event loop iteration into a single paint."""
+        for shape in shapes:
+            rect = self.shapeRect(shape)
+            if not rect.isEmpty():
+                self.update(rect)
+
+    def invalidateLayer(self):
+        """Force a rebuild of the static layer, for changes it cannot see
+        such as colors or visibility of shapes."""
+        self._layerKey = None
+        self.update()
+
+    def staticLayer(self, visible):
+        """Off-screen picture of the image, every shape but the selected one
+        in its resting look and all other contours, for the visible part of
+        the canvas. It is rebuilt when a shape, the zoom or the visible part
+        changes."""
+        # the selected shape is not part of the layer, dragging it must not
+        # invalidate the layer
+        version = sum(s.version for s in self.shapes if s is not self.selectedShape)
+        key = (visible, self.scale, self.offsetToCenter(), len(self.shapes), version,
+               self.selectedShape, self._hideBackround, self.showContourOverlay, self.pixmap, self.navigating)
+        if key == self._layerKey:
+            return self._layer
+        ratio = self.devicePixelRatioF() if hasattr(self, 'devicePixelRatioF') else 1.0
+        layer = QPixmap(visible.size() * ratio)
+        layer.setDevicePixelRatio(ratio)
+        layer.fill(Qt.transparent)
+        p = QPainter(layer)
+        p.translate(-visible.topLeft())
+        self.setupPainter(p, fast=self.navigating)
+        exposed = self.exposedImageRect(visible)
+        # one level coarser while panning or zooming, the full quality
+        # repaint follows when input stops
+        self.pixmap.draw(p, exposed.adjusted(-1, -1, 1, 1), self.scale / 2 if self.navigating else self.scale)
+        margin = self.paintMargin()
+        area = exposed.adjusted(-margin, -margin, margin, margin)
+        if not self._hideBackround:
+            self.renderer.paintShapes(p, [s for s in reversed(self.index.query(area.left(), area.top(), area.right(), area.bottom()))
+                                          if s is not self.selectedShape and self.isVisible(s)], self.scale)
+        if self.showContourOverlay:
+            self.renderer.paintContours(p, [s for s in self.shapes if s is not self.selectedShape and s.contourBounds().intersects(area)],
+                                        self.drawingContourColor)
+        p.end()
+        self._layer, self._layerKey = layer, key
+        return layer
+
     def createPoly(self, shape):
-            polygon = QPolygonF()
-            xmin, ymin = int(shape.points[0].x()), int(shape.points[0].y())
-            for p in shape.contour_points:
-                polygon.append(QPointF(p[1]+xmin, p[0]+ymin))  
-            return polygon
+        return shape.contourPolygon()
+
+    def exposedImageRect(self, rect):
+        """Map an exposed widget rectangle to image coordinates, limited to
+        the part of the canvas visible in the scroll area."""
+        visible = self.visibleRegion().boundingRect()
+        if not visible.isEmpty():
+            rect = rect.intersected(visible)
+        offset = self.offsetToCenter()
+        return QRectF(rect.x() / self.scale - offset.x(), rect.y() / self.scale - offset.y(),
+                      rect.width() / self.scale, rect.height() / self.scale)
+
+    def paintMargin(self):
+        """How far, in image pixels, vertex markers, pens and the confidence
+        label of a shape reach beyond its bounds."""
+        return 40.0 + 4 * Shape.point_size / self.scale
 
     def transformPos(self, point):
         """Convert from widget-logical coordinates to painter-logical coordinates."""
@@ -576,6 +694,7 @@ class Canvas(QWidget):
 
         self.current.close()
         self.shapes.append(self.current)
+        self.index.insert(self.current)
         self.current = None
         self.setHiding(False)
         self.newShape.emit()
@@ -659,6 +778,7 @@ class Canvas(QWidget):
             h_delta = delta.x()
             v_delta = delta.y()
 
+        self.beginInteraction(navigate=True)
         mods = ev.modifiers()
         if Qt.ControlModifier == int(mods) and v_delta:
             self.zoomRequest.emit(v_delta)
@@ -689,39 +809,41 @@ class Canvas(QWidget):
                 self.selectedShape.contourEdited = True
                 self.deSelectShape()
                 self.update()
+                self.editFinished.emit(False)
         elif key == Qt.Key_E and self.selectedShape and self.showContourOverlay:
             self.contourMode = True
             self.unHighlight()
             # print('Entering contour mode')
         elif key == Qt.Key_Q and self.selectedShape and self.contourMode:
             self.contourMode = False
-            self.selectedShape.contourEdited = True
+            shape = self.selectedShape
+            shape.contourEdited = True
             self.deSelectShape()
             # print('Leaving contour mode')
-            self.saveFileSignal.emit()
+            self.saveFileSignal.emit(shape)
         elif key == Qt.Key_N and self.selectedShape and self.contourMode:
-            if not self.selectedShape.contour_points:
+            if not len(self.selectedShape.contour_points):
                 self.selectedShape.contour_points = self.genContourInShape(self.selectedShape)
                 self.update()
+                self.editFinished.emit(False)
         elif key == Qt.Key_R and self.selectedShape and self.contourMode:
             self.selectedShape.contour_points = list()
             self.update()
+            self.editFinished.emit(False)
         elif key == Qt.Key_F and not self.contourMode:
             pos = self.globalMousePos
-            shapesIdx = list()
-            for s in self.shapes:
-                if s.containsPoint(pos):
-                    shapesIdx.append(self.shapes.index(s))
+            # overlapping shapes under the cursor, bottom first
+            shapesIdx = [s for s in reversed(self.index.candidates(pos)) if s.containsPoint(pos)]
             if len(shapesIdx) >= 2:
-                if sorted(self.memIdx) != sorted(shapesIdx):
+                if set(self.memIdx) != set(shapesIdx):
                     self.memIdx = shapesIdx
                     self.currentIdx = 0
                 else: 
                     self.currentIdx += 1
-                i = self.memIdx[self.currentIdx%len(self.memIdx)]
-                if self.selectedShape != self.shapes[i]: 
+                shape = self.memIdx[self.currentIdx%len(self.memIdx)]
+                if self.selectedShape != shape:
                     self.deSelectShape()
-                    self.selectShape(self.shapes[i])
+                    self.selectShape(shape)
                     self.update()
         return
 
@@ -742,32 +864,16 @@ class Canvas(QWidget):
 
     def moveOnePixel(self, direction):
         # print(self.selectedShape.points)
-        if direction == 'Left' and not self.moveOutOfBound(QPointF(-1.0, 0)):
-            # print("move Left one pixel")
-            self.selectedShape.points[0] += QPointF(-1.0, 0)
-            self.selectedShape.points[1] += QPointF(-1.0, 0)
-            self.selectedShape.points[2] += QPointF(-1.0, 0)
-            self.selectedShape.points[3] += QPointF(-1.0, 0)
-        elif direction == 'Right' and not self.moveOutOfBound(QPointF(1.0, 0)):
-            # print("move Right one pixel")
-            self.selectedShape.points[0] += QPointF(1.0, 0)
-            self.selectedShape.points[1] += QPointF(1.0, 0)
-            self.selectedShape.points[2] += QPointF(1.0, 0)
-            self.selectedShape.points[3] += QPointF(1.0, 0)
-        elif direction == 'Up' and not self.moveOutOfBound(QPointF(0, -1.0)):
-            # print("move Up one pixel")
-            self.selectedShape.points[0] += QPointF(0, -1.0)
-            self.selectedShape.points[1] += QPointF(0, -1.0)
-            self.selectedShape.points[2] += QPointF(0, -1.0)
-            self.selectedShape.points[3] += QPointF(0, -1.0)
-        elif direction == 'Down' and not self.moveOutOfBound(QPointF(0, 1.0)):
-            # print("move Down one pixel")
-            self.selectedShape.points[0] += QPointF(0, 1.0)
-            self.selectedShape.points[1] += QPointF(0, 1.0)
-            self.selectedShape.points[2] += QPointF(0, 1.0)
-            self.selectedShape.points[3] += QPointF(0, 1.0)
+        step = {'Left': QPointF(-1.0, 0), 'Right': QPointF(1.0, 0),
+                'Up': QPointF(0, -1.0), 'Down': QPointF(0, 1.0)}[direction]
+        dirty = self.shapeRect(self.selectedShape)
+        if not self.moveOutOfBound(step):
+            self.selectedShape.moveBy(step)
+        self.index.update(self.selectedShape)
         self.shapeMoved.emit()
-        self.repaint()
+        self.update(dirty)
+        self.updateShapes(self.selectedShape)
+        self.editFinished.emit(True)
 
     def moveOutOfBound(self, step):
         points = [p1+p2 for p1, p2 in zip(self.selectedShape.points, [step]*4)]
@@ -781,12 +887,14 @@ class Canvas(QWidget):
         
         if fill_color:
             self.shapes[-1].fill_color = fill_color
+        self._layerKey = None
 
         return self.shapes[-1]
 
     def undoLastLine(self):
         assert self.shapes
         self.current = self.shapes.pop()
+        self.index.remove(self.current)
         self.current.setOpen()
         self.line.points = [self.current[-1], self.current[0]]
         self.drawingPolygon.emit(True)
@@ -794,6 +902,7 @@ class Canvas(QWidget):
     def resetAllLines(self):
         assert self.shapes
         self.current = self.shapes.pop()
+        self.index.remove(self.current)
         self.current.setOpen()
         self.line.points = [self.current[-1], self.current[0]]
         self.drawingPolygon.emit(True)
@@ -801,19 +910,49 @@ class Canvas(QWidget):
         self.drawingPolygon.emit(False)
         self.update()
 
-    def loadPixmap(self, pixmap):
-        self.pixmap = pixmap
+    def loadPixmap(self, pixmap, owner=None):
+        """Show a QImage, or a QPixmap, with an empty shape list. `owner`
+        keeps the memory of a QImage on foreign data alive."""
+        if isinstance(pixmap, QPixmap):
+            pixmap = pixmap.toImage()
+        elif owner is None:
+            # without an owner the memory may go away, detach
+            pixmap = pixmap.copy()
+        if self.pixmap is not None:
+            self.pixmap.cancel()
+        self.pixmap = TilePyramid(pixmap, owner=owner)
+        self.pixmap.levelReady.connect(lambda level: self.invalidateLayer())
         self.shapes = []
-        self.repaint()
+        self.index.clear()
+        self.update()
 
     def loadShapes(self, shapes):
         self.shapes = list(shapes)
+        self.index.rebuild(self.shapes)
+        self._layerKey = None
         self.current = None
-        self.repaint()
+        self.update()
+
+    def shapesRestored(self):
+        """Drop selection and highlight after shapes were replaced by undo
+        or redo in place."""
+        for shape in self.shapes:
+            shape.selected = False
+            shape.highlightClear()
+        self.selectedShape = self.selectedShapeCopy = None
+        self.hShape = self.hVertex = None
+        self.cntOldidx = None
+        self.contourMode = False
+        self.setHiding(False)
+        self.index.rebuild(self.shapes)
+        self._layerKey = None
+        self.update()
+        self.selectionChanged.emit(False)
 
     def setShapeVisible(self, shape, value):
         self.visible[shape] = value
-        self.repaint()
+        self._layerKey = None
+        self.update()
 
     def currentCursor(self):
         cursor = QApplication.overrideCursor()
@@ -833,6 +972,8 @@ class Canvas(QWidget):
 
     def resetState(self):
         self.restoreCursor()
+        if self.pixmap is not None:
+            self.pixmap.cancel()
         self.pixmap = None
         self.memIdx = list()
         self.currentIdx = 0
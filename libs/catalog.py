@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""Project catalog: one SQLite database per folder with every image, shape,
+contour and measurement, so cohort queries do not re-parse all annotations.
+
+    python -m libs.catalog FOLDER sync
+    python -m libs.catalog FOLDER query [--min-area A] [--max-area A]
+                                        [--min-confidence C] [--image PATTERN]
+                                        [--scaled]
+
+The catalog is kept only when it is enabled in the tool, which then updates
+it incrementally on every save, detection and results export. Annotation
+files changed outside the tool are picked up lazily: `sync`, and `query`
+before it reads, update the images whose annotation changed since it was
+stored.
+"""
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from libs.pascal_voc_io import PascalVocReader, XML_EXT, encodeContour
+from libs.dirScanner import findImages
+from libs.measurement import polygonMorphometry
+
+CATALOG_FILE = 'catalog.sqlite'
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    height INTEGER,
+    width INTEGER,
+    verified INTEGER NOT NULL DEFAULT 0,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    label TEXT,
+    xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+    confidence REAL,
+    contour_edited INTEGER NOT NULL DEFAULT 0,
+    mask_label INTEGER,
+    contour_encoding TEXT,
+    contour TEXT,
+    area REAL,
+    perimeter REAL,
+    UNIQUE (image_id, number)
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    shape_id INTEGER PRIMARY KEY REFERENCES shapes(id) ON DELETE CASCADE,
+    pixel_scale REAL,
+    area REAL,
+    perimeter REAL,
+    radius REAL,
+    volume REAL,
+    label_area REAL,
+    exclusive_area REAL,
+    label_perimeter REAL,
+    intensity_mean REAL,
+    intensity_median REAL,
+    intensity_std REAL
+);
+CREATE INDEX IF NOT EXISTS shapes_image ON shapes (image_id);
+CREATE INDEX IF NOT EXISTS shapes_area ON shapes (area);
+CREATE INDEX IF NOT EXISTS shapes_confidence ON shapes (confidence);
+CREATE INDEX IF NOT EXISTS measurements_area ON measurements (area);
+'''
+
+MEASUREMENTS = ('area', 'perimeter', 'radius', 'volume', 'label_area', 'exclusive_area',
+                'label_perimeter', 'intensity_mean', 'intensity_median', 'intensity_std')
+
+
+class ProjectCatalog(object):
+    """Catalog database of a project folder.
+
+    Shapes are the dicts the tool saves (points, label, contour_points,
+    confidence, contourEdited, maskLabel). Writes may come from the
+    background worker that stores annotations, so all access is locked.
+    """
+
+    def __init__(self, folder, filename=CATALOG_FILE):
+        self.folder = os.path.abspath(folder)
+        self.path = os.path.join(self.folder, filename)
+        self._lock = threading.Lock()
+        self.closed = False
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.execute('PRAGMA journal_mode = WAL')
+        with self._db:
+            self._db.executescript(SCHEMA)
+            self._db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._db.close()
+
+    def relativePath(self, imagePath):
+        return os.path.relpath(os.path.abspath(imagePath), self.folder)
+
+    def _imageId(self, imagePath, imageShape=None, verified=None, mtime=None):
+        path = self.relativePath(imagePath)
+        self._db.execute('INSERT OR IGNORE INTO images (path) VALUES (?)', (path,))
+        if imageShape is not None:
+            self._db.execute('UPDATE images SET height = ?, width = ? WHERE path = ?', (imageShape[0], imageShape[1], path))
+        if verified is not None:
+            self._db.execute('UPDATE images SET verified = ? WHERE path = ?', (int(bool(verified)), path))
+        if mtime is not None:
+            self._db.execute('UPDATE images SET mtime = ? WHERE path = ?', (mtime, path))
+        return self._db.execute('SELECT id FROM images WHERE path = ?', (path,)).fetchone()[0]
+
+    def updateImage(self, imagePath, shapes, imageShape=None, verified=None):
+        """Replace all shapes of one image, measurements of the image are
+        dropped as they no longer match."""
+        annotationPath = os.path.splitext(imagePath)[0] + XML_EXT
+        mtime = os.path.getmtime(annotationPath) if os.path.isfile(annotationPath) else None
+        rows = []
+        for number, shape in enumerate(shapes, 1):
+            xs = [p[0] for p in shape['points']]
+            ys = [p[1] for p in shape['points']]
+            encoding, contour = encodeContour(shape['contour_points'])
+            area, perimeter = polygonMorphometry(shape['contour_points'])
+            rows.append((number, shape['label'], min(xs), min(ys), max(xs), max(ys), shape['confidence'],
+                         int(bool(shape['contourEdited'])), shape.get('maskLabel'), encoding, contour, area, perimeter))
+        with self._lock, self._db:
+            imageId = self._imageId(imagePath, imageShape, verified, mtime)
+            self._db.execute('DELETE FROM shapes WHERE image_id = ?', (imageId,))
+            self._db.executemany('INSERT INTO shapes (image_id, number, label, xmin, ymin, xmax, ymax, confidence, '
+                                 'contour_edited, mask_label, contour_encoding, contour, area, perimeter) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(imageId,) + row for row in rows])
+
+    def updateFromAnnotation(self, imagePath):
+        """Read the annotation file of an image into the catalog, an image
+        without annotation loses its shapes."""
+        annotationPath = os.path.splitext(imagePath)[0] + XML_EXT
+        if not os.path.isfile(annotationPath):
+            self.removeImage(imagePath)
+            return
+        reader = PascalVocReader(annotationPath, lazy=True)
+        shapes = [dict(label=label, points=points, contour_points=contour_points, confidence=confidence,
+                       contourEdited=contourEdited, maskLabel=maskLabel)
+                  for label, points, lineColor, fillColor, contour_points, confidence, contourEdited, maskLabel
+                  in reader.iterShapes()]
+        self.updateImage(imagePath, shapes, reader.imgSize, reader.verified)
+
+    def removeImage(self, imagePath):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM images WHERE path = ?', (self.relativePath(imagePath),))
+
+    def setMeasurements(self, imagePath, measurements, pixelScale):
+        """Store measurements of an image given as {shape number: dict}
+        with the keys of MEASUREMENTS."""
+        with self._lock, self._db:
+            imageId = self._imageId(imagePath)
+            ids = dict(self._db.execute('SELECT number, id FROM shapes WHERE image_id = ?', (imageId,)).fetchall())
+            rows = [(ids[number], pixelScale) + tuple(values.get(k) for k in MEASUREMENTS)
+                    for number, values in measurements.items() if number in ids]
+            self._db.executemany('INSERT OR REPLACE INTO measurements (shape_id, pixel_scale, %s) VALUES (?, ?, %s)'
+                                 % (', '.join(MEASUREMENTS), ', '.join('?' * len(MEASUREMENTS))), rows)
+
+    def sync(self, imagePaths=None):
+        """Update every image whose annotation changed since it was stored,
+        return the number of updated images. Annotations that cannot be
+        read are logged and skipped, they are tried again on the next sync."""
+        if imagePaths is None:
+            imagePaths = findImages(self.folder)
+        with self._lock:
+            known = dict(self._db.execute('SELECT path, mtime FROM images').fetchall())
+        updated = 0
+        seen = set()
+        for imagePath in imagePaths:
+            if self.closed:
+                # the folder was closed while syncing
+                return updated
+            path = self.relativePath(imagePath)
+            seen.add(path)
+            annotationPath = os.path.splitext(imagePath)[0] + XML_EXT
+            mtime = os.path.getmtime(annotationPath) if os.path.isfile(annotationPath) else None
+            if path in known and known[path] == mtime:
+                continue
+            if mtime is None and path not in known:
+                continue
+            try:
+                self.updateFromAnnotation(imagePath)
+            except sqlite3.Error:
+                raise
+            except Exception as e:
+                logging.error('Reading {0} into the catalog failed: {1}'.format(annotationPath, e))
+                continue
+            updated += 1
+        for path in set(known) - seen:
+            self.removeImage(os.path.join(self.folder, path))
+            updated += 1
+        return updated
+
+    def query(self, minArea=None, maxArea=None, minConfidence=None, image=None, scaled=False):
+        """Return shapes with their image and measurements as sqlite3.Row.
+        Areas are pixel areas of the contour, or with scaled=True the
+        measured areas of the last results export (measured shapes only)."""
+        areaColumn = 'm.area' if scaled else 's.area'
+        where, params = [], []
+        if minArea is not None:
+            where.append(areaColumn + ' >= ?')
+            params.append(minArea)
+        if maxArea is not None:
+            where.append(areaColumn + ' <= ?')
+            params.append(maxArea)
+        if minConfidence is not None:
+            where.append('s.confidence >= ?')
+            params.append(minConfidence)
+        if image is not None:
+            where.append('i.path GLOB ?')
+            params.append(image)
+        sql = ('SELECT i.path, s.number, s.label, s.xmin, s.ymin, s.xmax, s.ymax, s.confidence, s.contour_edited, '
+               's.area AS pixel_area, s.perimeter AS pixel_perimeter, m.pixel_scale, %s '
+               'FROM shapes s JOIN images i ON i.id = s.image_id %s JOIN measurements m ON m.shape_id = s.id'
+               % (', '.join('m.' + k for k in MEASUREMENTS), '' if scaled else 'LEFT'))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY i.path, s.number'
+        return self.execute(sql, params)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Projektkatalog abfragen und aktualisieren')
+    parser.add_argument('folder')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('sync', help='Katalog mit den Annotationen abgleichen')
+    query = commands.add_parser('query', help='Zellen als CSV ausgeben')
+    query.add_argument('--min-area', type=float, default=None)
+    query.add_argument('--max-area', type=float, default=None)
+    query.add_argument('--min-confidence', type=float, default=None)
+    query.add_argument('--image', default=None, help='Bildpfad, Platzhalter * und ? erlaubt')
+    query.add_argument('--scaled', action='store_true', help='Gemessene statt Pixel-Flächen verwenden')
+    args = parser.parse_args(argv)
+
+    catalog = ProjectCatalog(args.folder)
+    try:
+        updated = catalog.sync()
+        if args.command == 'sync':
+            print('{0} Bilder aktualisiert'.format(updated))
+        else:
+            rows = catalog.query(args.min_area, args.max_area, args.min_confidence, args.image, args.scaled)
+            out = csv.writer(sys.stdout)
+            if rows:
+                out.writerow(rows[0].keys())
+            out.writerows(tuple(row) for row in rows)
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
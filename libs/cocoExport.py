@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""Export the annotations of a whole folder into one COCO JSON file.
+
+    python -m libs.cocoExport [--rle] [-j JOBS] FOLDER OUTPUT.json
+
+Masks are written as polygons, or with --rle as compressed RLE masks in
+the format of pycocotools. Images are processed in a process pool and the
+annotations are streamed into the output file, the image entries through a
+temporary file, so memory use does not grow with the number of images.
+"""
+try:
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtCore import *
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from skimage.draw import polygon as rasterPolygon
+
+from libs.dirScanner import findImages
+from libs.maskSidecar import readSidecar, maskPixels
+from libs.measurement import absoluteContour, polygonMorphometry
+from libs.pascal_voc_io import PascalVocReader, XML_EXT
+
+CATEGORIES = [{'id': 1, 'name': 'cell', 'supercategory': 'cell'}]
+
+
+def findAnnotatedImages(folder):
+    return [imagePath for imagePath in findImages(folder)
+            if os.path.isfile(os.path.splitext(imagePath)[0] + XML_EXT)]
+
+
+def rleCounts(rr, cc, height, width):
+    """Run lengths of a mask given by its pixel coordinates, in the column
+    major order COCO uses, starting with a run of background. The counts
+    are the ones pycocotools' encode produces."""
+    if len(rr) == 0:
+        return [height * width]
+    idx = np.sort(cc.astype(np.int64) * height + rr)
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    starts = idx[np.r_[0, breaks]]
+    ends = idx[np.r_[breaks - 1, len(idx) - 1]] + 1
+    counts = np.empty(2 * len(starts) + 1, dtype=np.int64)
+    counts[0] = starts[0]
+    counts[1:-1:2] = ends - starts
+    counts[2:-1:2] = starts[1:] - ends[:-1]
+    counts[-1] = height * width - ends[-1]
+    # like pycocotools, no empty run of background at the end
+    if counts[-1] == 0:
+        counts = counts[:-1]
+    return counts.tolist()
+
+
+def rleString(counts):
+    """Compress run lengths like pycocotools' rleToString."""
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def exportImage(imagePath, folder, rle=False):
+    """Return the COCO image entry and the annotations (without ids) of one
+    annotated image."""
+    reader = PascalVocReader(os.path.splitext(imagePath)[0] + XML_EXT, lazy=True)
+    shapes = list(reader.iterShapes())
+    if reader.imgSize and reader.imgSize[0] and reader.imgSize[1]:
+        height, width = reader.imgSize[0], reader.imgSize[1]
+    else:
+        # PIL reads only the header here
+        with Image.open(imagePath) as img:
+            width, height = img.size
+    image = {'file_name': os.path.relpath(imagePath, folder), 'height': height, 'width': width}
+
+    # exact detection masks, as long as the contour was not edited by hand
+    labels = readSidecar(imagePath) if any(s[7] is not None and not s[6] for s in shapes) else None
+    annotations = []
+    for label, points, lineColor, fillColor, contour_points, confidence, contourEdited, maskLabel in shapes:
+        (xmin, ymin), (xmax, ymax) = points[0], points[2]
+        annotation = {'category_id': 1, 'iscrowd': 0, 'score': confidence,
+                      'bbox': [xmin, ymin, xmax - xmin, ymax - ymin]}
+        cnt = absoluteContour(xmin, ymin, contour_points)
+        if labels is not None and maskLabel is not None and not contourEdited and labels.shape == (height, width):
+            rr, cc = maskPixels(labels, maskLabel, xmin, ymin, xmax, ymax)
+            if rle or len(cnt) < 3:
+                annotation['segmentation'] = {'size': [height, width], 'counts': rleString(rleCounts(rr, cc, height, width))}
+            else:
+                annotation['segmentation'] = [np.column_stack((cnt[:, 1], cnt[:, 0])).ravel().tolist()]
+            annotation['area'] = float(len(rr))
+        elif len(cnt) < 3:
+            annotation['segmentation'] = []
+            annotation['area'] = float((xmax - xmin) * (ymax - ymin))
+        elif rle:
+            rr, cc = rasterPolygon(cnt[:, 0], cnt[:, 1], shape=(height, width))
+            annotation['segmentation'] = {'size': [height, width], 'counts': rleString(rleCounts(rr, cc, height, width))}
+            annotation['area'] = float(len(rr))
+        else:
+            y, x = cnt[:, 0], cnt[:, 1]
+            annotation['segmentation'] = [np.column_stack((x, y)).ravel().tolist()]
+            annotation['area'] = polygonMorphometry(cnt)[0]
+        annotations.append(annotation)
+    return image, annotations
+
+
+def _exportImage(imagePath, folder, rle):
+    # errors of lxml cannot be pickled back from the worker process
+    try:
+        return exportImage(imagePath, folder, rle)
+    except Exception as e:
+        raise RuntimeError(str(e) or type(e).__name__)
+
+
+def exportFolder(folder, outputPath, rle=False, jobs=None, progress=None):
+    """Write all annotations below `folder` to `outputPath`. Images whose
+    annotation cannot be read are skipped; return the number of exported
+    images and the list of (image path, error) of the skipped ones.
+    `progress(done, total)` is called after every image."""
+    images = findAnnotatedImages(folder)
+    window = 4 * (jobs or os.cpu_count() or 1)
+    failed = []
+    imageId = 0
+    annotationId = 0
+    # spawned workers do not inherit the threads and the Qt state of the GUI
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(jobs, mp_context=context) as pool, \
+            open(outputPath, 'w', encoding='utf-8') as out, \
+            tempfile.TemporaryFile('w+', encoding='utf-8', dir=os.path.dirname(os.path.abspath(outputPath))) as entries:
+        out.write('{"info": %s, "categories": %s, "annotations": [' % (
+            json.dumps({'description': 'ADPKD Support Tool export'}), json.dumps(CATEGORIES)))
+
+        def writeNext():
+            nonlocal imageId, annotationId
+            done, imagePath, future = pending.popleft()
+            try:
+                image, annotations = future.result()
+            except Exception as e:
+                failed.append((imagePath, e))
+                if progress is not None:
+                    progress(done, len(images))
+                return
+            imageId += 1
+            image['id'] = imageId
+            entries.write((',\n' if imageId > 1 else '') + json.dumps(image))
+            for annotation in annotations:
+                annotationId += 1
+                annotation['id'] = annotationId
+                annotation['image_id'] = imageId
+                out.write((',' if annotationId > 1 else '') + '\n' + json.dumps(annotation))
+            if progress is not None:
+                progress(done, len(images))
+
+        # at most `window` images are in flight, results are written in order
+        pending = deque()
+        for done, imagePath in enumerate(images, 1):
+            pending.append((done, imagePath, pool.submit(_exportImage, imagePath, folder, rle)))
+            if len(pending) >= window:
+                writeNext()
+        while pending:
+            writeNext()
+        out.write('\n], "images": [')
+        entries.seek(0)
+        shutil.copyfileobj(entries, out)
+        out.write(']}\n')
+    return imageId, failed
+
+
+class CocoExporter(QObject):
+    """Runs exportFolder in a background thread. `progress(done, total)` is
+    emitted for every image, `finished` carries the (count, failed) result
+    of exportFolder or the exception it raised."""
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+
+    def start(self, folder, outputPath, rle=False, jobs=None):
+        threading.Thread(target=self._run, args=(folder, outputPath, rle, jobs), daemon=True).start()
+
+    def _run(self, folder, outputPath, rle, jobs):
+        try:
+            result = exportFolder(folder, outputPath, rle, jobs, progress=self.progress.emit)
+        except Exception as e:
+            result = e
+        self.finished.emit(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Annotationen eines Ordners als COCO JSON exportieren')
+    parser.add_argument('folder')
+    parser.add_argument('output')
+    parser.add_argument('--rle', action='store_true', help='Masken als RLE statt als Polygon speichern')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Anzahl paralleler Prozesse')
+    args = parser.parse_args(argv)
+    count, failed = exportFolder(args.folder, args.output, args.rle, args.jobs)
+    print('{0} Bilder nach {1} exportiert'.format(count, args.output))
+    for imagePath, e in failed:
+        print('{0} übersprungen: {1}'.format(imagePath, e), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,4 +12,8 @@ SETTING_LAST_OPEN_DIR = 'lastOpenDir'
 SETTING_AUTO_SAVE = 'autosave'
 SETTING_SINGLE_CLASS = 'singleclass'
 SETTING_PIXEL_SCALING = 'pixelscale'
+SETTING_MASK_SIDECAR = 'masksidecar'
+SETTING_UNDO_MEMORY = 'undomemory'
+SETTING_PREFETCH_MEMORY = 'prefetchmemory'
+SETTING_CATALOG = 'catalog'
 SETTING_UNET_USAGE = True
@@ -4,6 +4,7 @@ import numpy as np
 # from libs.utils import get_yolo_boxes
 from keras.models import load_model
 from libs.bbox import BoundBox
+from libs.maskSidecar import buildContourPoints
 from libs.mrcnn.config import Config
 from libs.mrcnn import model as modellib, utils
 from libs.unet import model as unetModel
@@ -42,33 +43,11 @@ class MaskRCNNDetector:
         self.model.load_weights(weights_path, by_name=True)
 
     def buildContourPoints(self, bin_img):
-        points = list()
-        ls = bin_img.astype(np.uint8)
-        left_side, right_side = list(), list()
-        top_side, bottom_side = list(), list()
-        for y in range(ls.shape[0]):
-            try:
-                x_left, x_right = np.where(ls[y, :] == 1)[0][0], np.where(ls[y, :] == 1)[0][-1]
-                left_side.append((y, x_left))
-                right_side.append((y, x_right))
-            except Exception as e:
-                # print(e)
-                continue
-        for x in range(ls.shape[1]):
-            try:
-                y_top, y_bottom = np.where(ls[:, x] == ls[:, x].max())[0][0], np.where(ls[:, x] == ls[:, x].max())[0][-1]
-                top_side.append((y_top, x))
-                bottom_side.append((y_bottom, x))
-            except Exception as e:
-                # print(e)
-                continue
-        points = [x for i, x in enumerate(left_side+list(reversed(right_side))) if (x in top_side+list(reversed(bottom_side)))]
-        if len(points) > 30: 
-            points = [x for i,x in enumerate(points) if i % 4 == 0]
-        # points = [x for i, x in enumerate(points) if i % 5 == 0]
-        return points
-    
-    def predictBoxesAndContour(self, img=None):
+        return buildContourPoints(bin_img)
+
+    def predictBoxesAndContour(self, img=None, returnLabels=False):
+        """Detect cells, with returnLabels also return the full resolution
+        instance label map, value i belongs to the box with maskLabel i."""
         boxes = list()
         if img is None: 
             print('Missing image: No image provided')
@@ -78,14 +57,19 @@ class MaskRCNNDetector:
             r = self.model.detect([img], verbose=0)[0]
             rois, masks, confidences = r['rois'], r['masks'], r['scores']
             masks = np.rollaxis(masks, 2, 0)
-            for roi, mask, confidence in zip(rois, masks, confidences):
+            labels = np.zeros((height, width), dtype=np.uint16)
+            for maskLabel, (roi, mask, confidence) in enumerate(zip(rois, masks, confidences), 1):
                 # print(roi, mask)
                 ymin, ymax, xmin, xmax = np.clip(roi[0] - 5, 0, height), np.clip(roi[2] + 5, 0, height), np.clip(roi[1] - 5, 0, width), np.clip(roi[3] + 5, 0, width)  # 5 pixel border for bigger local canvas
                 m = (mask[ymin:ymax, xmin:xmax])
                 bin_img = np.zeros(m.shape).astype(np.uint8)
                 bin_img[m] = 1
                 contour = self.buildContourPoints(bin_img)
-                boxes.append(BoundBox(xmin, ymin, xmax, ymax, contour=contour, confidence=confidence))
+                # detections come sorted by score, the more confident one keeps overlapping pixels
+                labels[mask & (labels == 0)] = maskLabel
+                boxes.append(BoundBox(xmin, ymin, xmax, ymax, contour=contour, confidence=confidence, maskLabel=maskLabel))
+        if returnLabels:
+            return boxes, labels
         return boxes
 
 class UNetSegmentation:
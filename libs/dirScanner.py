@@ -0,0 +1,183 @@
+try:
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtCore import *
+
+import json
+import logging
+import os
+import threading
+import time
+
+from libs.maskSidecar import isSidecar
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.bmp')
+# directory listings of the last scan, kept in the scanned folder
+SCAN_MANIFEST = '.scan-manifest.json'
+BATCH_SIZE = 500
+BATCH_INTERVAL = 0.1
+
+
+def sortImages(imagePaths):
+    return sorted(imagePaths, key=lambda x: x.lower())
+
+
+def isImageFile(name):
+    """True for the image formats the tool opens, mask sidecars excluded."""
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not isSidecar(name)
+
+
+def findImages(folder):
+    """All images below a folder, sorted like the file list. This walks
+    the folder in the calling thread, without the manifest of DirScanner."""
+    images = []
+    stack = [folder]
+    while stack:
+        directory = stack.pop()
+        names, subdirs = listDirectory(directory)
+        images.extend(os.path.join(directory, name) for name in names)
+        stack.extend(os.path.join(directory, d) for d in subdirs)
+    return sortImages(images)
+
+
+class DirScanner(QObject):
+    """Finds the images below a folder in a background thread.
+
+    Paths are emitted with `found` in batches while the scan runs, in the
+    order the directories are visited, and `finished` carries the complete
+    list sorted like the file list. The listing of every directory is
+    stored with its mtime in a manifest; a directory whose mtime did not
+    change is taken from the manifest instead of being listed again, so
+    reopening a folder only stats its directories.
+    """
+    found = pyqtSignal(list)
+    finished = pyqtSignal(list)
+    # results of the worker thread, delivered through the event loop
+    _batch = pyqtSignal(int, list)
+    _done = pyqtSignal(int, list)
+
+    def __init__(self, parent=None):
+        super(DirScanner, self).__init__(parent)
+        self._generation = 0
+        self._thread = None
+        self._result = None
+        self._delivered = True
+        self._batch.connect(self._deliverBatch)
+        self._done.connect(self._deliverDone)
+
+    def scan(self, folder):
+        self.cancel()
+        self._generation += 1
+        self._result = None
+        self._delivered = False
+        self._thread = threading.Thread(target=self._scan, args=(os.path.abspath(folder), self._generation), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop delivering results of the running scan, the thread ends
+        after its current directory."""
+        self._generation += 1
+        self._delivered = True
+
+    def wait(self):
+        """Block until the running scan is done and return its sorted images
+        instead of emitting them with `finished`, batches not delivered yet
+        are dropped. None if no scan is pending."""
+        if self._delivered:
+            return None
+        self._thread.join()
+        self._delivered = True
+        return self._result
+
+    def _deliverBatch(self, generation, paths):
+        if generation == self._generation and not self._delivered:
+            self.found.emit(paths)
+
+    def _deliverDone(self, generation, paths):
+        if generation == self._generation and not self._delivered:
+            self._delivered = True
+            self.finished.emit(paths)
+
+    def _scan(self, folder, generation):
+        manifestPath = os.path.join(folder, SCAN_MANIFEST)
+        manifest = loadManifest(manifestPath)
+        listings = {}
+        images = []
+        batch = []
+        lastEmit = time.time()
+        stack = [folder]
+        while stack:
+            if generation != self._generation:
+                return
+            directory = stack.pop()
+            relative = os.path.relpath(directory, folder)
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+            cached = manifest.get(relative)
+            if cached is not None and cached[0] == mtime:
+                names, subdirs = cached[1], cached[2]
+            else:
+                names, subdirs = listDirectory(directory)
+            listings[relative] = [mtime, names, subdirs]
+            paths = [os.path.join(directory, name) for name in names]
+            images.extend(paths)
+            batch.extend(paths)
+            # reversed, so the stack visits subdirectories in sorted order
+            stack.extend(os.path.join(directory, d) for d in reversed(subdirs))
+            if batch and (len(batch) >= BATCH_SIZE or time.time() - lastEmit >= BATCH_INTERVAL):
+                self._batch.emit(generation, batch)
+                batch, lastEmit = [], time.time()
+        if batch:
+            self._batch.emit(generation, batch)
+        images = sortImages(images)
+        if listings != manifest:
+            saveManifest(manifestPath, folder, listings)
+        if generation == self._generation:
+            self._result = images
+        self._done.emit(generation, images)
+
+
+def listDirectory(directory):
+    """Image file names and subdirectory names of a directory, sorted."""
+    names, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif isImageFile(entry.name):
+                        names.append(entry.name)
+                except OSError:
+                    continue
+    except OSError as e:
+        logging.error('Listing {0} failed: {1}'.format(directory, e))
+    names.sort(key=lambda x: x.lower())
+    subdirs.sort(key=lambda x: x.lower())
+    return names, subdirs
+
+
+def loadManifest(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def saveManifest(path, folder, listings):
+    try:
+        if not os.path.exists(path):
+            # creating the file changes the mtime of the folder, the
+            # listing is still valid as the manifest is no image
+            open(path, 'w').close()
+            listings['.'][0] = os.stat(folder).st_mtime
+        # written in place, replacing the file would change the mtime again
+        with open(path, 'w') as f:
+            json.dump(listings, f)
+    except OSError as e:
+        # read only folders are scanned in full every time
+        logging.info('Writing {0} failed: {1}'.format(path, e))
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+JOURNAL_EXT = '.journal'
+
+# all compactions run one after another on a single worker, so an older
+# state can never overwrite a newer one
+_compactor = ThreadPoolExecutor(max_workers=1)
+
+
+def waitForCompactions():
+    """Block until every compaction submitted so far is done."""
+    _compactor.submit(lambda: None).result()
+
+
+def annotationDigest(annotationPath):
+    """SHA-1 of an annotation file, None if it does not exist."""
+    try:
+        with open(annotationPath, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _toJson(obj):
+    # numpy arrays and scalars
+    return obj.tolist()
+
+
+class EditJournal(object):
+    """Append-only log of shape edits, kept next to the annotation file.
+
+    The first line names the annotation file the records apply to:
+        {"op": "base", "sha1": ...}                 digest of the file
+    followed by one JSON line per record:
+        {"op": "put", "index": i, "shape": {...}}   replace or append shape i
+        {"op": "del", "index": i}                   remove shape i
+        {"op": "reset", "shapes": [...]}            replace all shapes
+    Replaying the records in order on the shapes of the annotation file
+    gives the edited state. compact() writes the current state into the
+    annotation file and drops the records it covers. A journal whose base
+    does not match the annotation file, e.g. after a crash between writing
+    the file and dropping the records, is stale and never replayed.
+    Records are flushed on append and synced to disk when compacting.
+    """
+
+    def __init__(self, annotationPath):
+        self.annotationPath = annotationPath
+        self.path = os.path.splitext(annotationPath)[0] + JOURNAL_EXT
+        self._lock = threading.Lock()
+        self._file = None
+        # record bytes ever appended, and record bytes already dropped by
+        # compaction; the file holds the header and the records after
+        # self._compacted
+        self._written = 0
+        self._compacted = 0
+        self._headerSize = 0
+        self._pending = None
+        if os.path.isfile(self.path):
+            self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+        try:
+            base = json.loads(header.decode('utf-8'))
+            stale = base.get('op') != 'base' or base.get('sha1') != annotationDigest(self.annotationPath)
+        except ValueError:
+            stale = True
+        if stale:
+            logging.warning('Dropping the stale journal ' + self.path)
+            os.remove(self.path)
+            return
+        self._headerSize = len(header)
+        self._written = os.path.getsize(self.path) - self._headerSize
+
+    def _header(self):
+        return (json.dumps({'op': 'base', 'sha1': annotationDigest(self.annotationPath)}) + '\n').encode('utf-8')
+
+    def hasRecords(self):
+        return self._written > self._compacted
+
+    def put(self, index, shape):
+        self._append({'op': 'put', 'index': index, 'shape': shape})
+
+    def delete(self, index):
+        self._append({'op': 'del', 'index': index})
+
+    def reset(self, shapes):
+        self._append({'op': 'reset', 'shapes': shapes})
+
+    def _append(self, record):
+        line = (json.dumps(record, default=_toJson) + '\n').encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+                if self._file.tell() == 0:
+                    header = self._header()
+                    self._file.write(header)
+                    self._headerSize = len(header)
+            self._file.write(line)
+            self._file.flush()
+            self._written += len(line)
+
+    def replay(self, shapes):
+        """Return `shapes` with all journal records applied, or None if there
+        is nothing to replay."""
+        if not self.hasRecords():
+            return None
+        shapes = list(shapes)
+        with open(self.path, 'rb') as f:
+            f.readline()
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # torn last record of a crash
+                    break
+                op = record['op']
+                if op == 'reset':
+                    shapes = record['shapes']
+                elif op == 'del':
+                    del shapes[record['index']]
+                elif record['index'] < len(shapes):
+                    shapes[record['index']] = record['shape']
+                else:
+                    shapes.append(record['shape'])
+        return shapes
+
+    def compact(self, write, wait=False):
+        """Run `write`, which must store the current shapes in the annotation
+        file, on the background worker and drop the records it covers."""
+        covered = self._written
+        self._pending = _compactor.submit(self._compact, write, covered)
+        if wait:
+            self._pending.result()
+
+    def _compact(self, write, covered):
+        with self._lock:
+            if self._file is not None:
+                # the records have to survive a crash while writing
+                _fsync(self._file)
+        try:
+            write()
+        except Exception as e:
+            logging.error('Compacting {0} failed: {1}'.format(self.path, e))
+            raise
+        # a crash from here until the journal is replaced leaves a journal
+        # based on the old file, which is dropped as stale when loading
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if covered >= self._written:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self._headerSize = 0
+            else:
+                # keep the records appended while writing, based on the
+                # new file
+                with open(self.path, 'rb') as f:
+                    f.seek(self._headerSize + covered - self._compacted)
+                    tail = f.read()
+                header = self._header()
+                tmpPath = self.path + '.tmp'
+                with open(tmpPath, 'wb') as f:
+                    f.write(header)
+                    f.write(tail)
+                    _fsync(f)
+                os.replace(tmpPath, self.path)
+                self._headerSize = len(header)
+            self._compacted = covered
+
+    def wait(self):
+        if self._pending is not None:
+            try:
+                self._pending.result()
+            except Exception:
+                pass
+
+    def discard(self):
+        """Drop all records, e.g. when the annotation file gets replaced."""
+        self.wait()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._headerSize = 0
+            self._compacted = self._written
@@ -3,13 +3,13 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
-labels1 = ['MarkierungsNr.', 'Dateiname', 'area', 'perim', 'radius', 'Volumen']
+labels1 = ['MarkierungsNr.', 'Dateiname', 'area', 'area (Labelbild)', 'area (exklusiv)', 'perim', 'perim (Labelbild)', 'radius', 'Volumen', 'Intensität Mittel', 'Intensität Median', 'Intensität Std']
 labels2 = ['Dateiname', 'Zellenanzahl'] 
 
 
 class cellTableGenerator:
     def __init__(self, filename):
-        self.wb = xlsxwriter.Workbook('{0}'.format(filename))
+        self.wb = xlsxwriter.Workbook('{0}'.format(filename), {'nan_inf_to_errors': True})
         self.ws1 = self.wb.add_worksheet()
         self.ws2 = self.wb.add_worksheet()
         bold = self.wb.add_format({'bold': True})
@@ -19,7 +19,9 @@ class cellTableGenerator:
             self.ws2.write(4, i, l, bold)
         self.ws1.set_column('A:A', 13)
         self.ws1.set_column('B:B', 30)
-        self.ws1.set_column('F:F', 15)
+        self.ws1.set_column('D:E', 15)
+        self.ws1.set_column('G:G', 15)
+        self.ws1.set_column('I:L', 15)
         self.ws2.set_column('A:A', 30)
         self.ws2.set_column('B:B', 13)
         self.writer1_row = 6
@@ -28,8 +30,8 @@ class cellTableGenerator:
     def close(self):
         self.wb.close()
 
-    def add_cell(self, idx, image_filename, area, perim, radius, v):
-        for c, e in enumerate([idx, image_filename, area, perim, radius, v]):
+    def add_cell(self, idx, image_filename, area, perim, radius, v, label_area, exclusive_area, label_perim, mean, median, std):
+        for c, e in enumerate([idx, image_filename, area, label_area, exclusive_area, perim, label_perim, radius, v, mean, median, std]):
             self.ws1.write(self.writer1_row, c, e)
         self.writer1_row += 1
 
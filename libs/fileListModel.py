@@ -0,0 +1,102 @@
+try:
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtCore import *
+
+
+class FileListModel(QAbstractTableModel):
+    """Images of the opened folder for the file dock.
+
+    Rows are only asked for when the view shows them, so a folder with
+    100k images costs one list and one dict. The status columns come from
+    the AnnotationIndex, which parses the annotations in the background;
+    rows it reports as changed are repainted in batches.
+    """
+    HEADERS = (u'Bild', u'Zellen', u'Verifiziert', u'Bearbeitet')
+
+    def __init__(self, annotationIndex, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self.annotationIndex = annotationIndex
+        self.annotationIndex.changed.connect(self.summaryChanged)
+        self._paths = []
+        self._rows = {}
+        self._changed = set()
+        self._flushTimer = QTimer(self)
+        self._flushTimer.setSingleShot(True)
+        self._flushTimer.setInterval(100)
+        self._flushTimer.timeout.connect(self.flushChanges)
+
+    def setImages(self, imagePaths):
+        self.beginResetModel()
+        self._paths = list(imagePaths)
+        self._rows = dict((path, row) for row, path in enumerate(self._paths))
+        self._changed.clear()
+        self.endResetModel()
+
+    def appendImages(self, imagePaths):
+        if not imagePaths:
+            return
+        first = len(self._paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(imagePaths) - 1)
+        for row, path in enumerate(imagePaths, first):
+            self._rows[path] = row
+        self._paths.extend(imagePaths)
+        self.endInsertRows()
+
+    def paths(self):
+        return self._paths
+
+    def path(self, row):
+        return self._paths[row]
+
+    def row(self, imagePath):
+        """Row of an image, None if it is not in the list."""
+        return self._rows.get(imagePath)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, imagePath):
+        return imagePath in self._rows
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._paths)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        path = self._paths[index.row()]
+        if index.column() == 0:
+            return path
+        if role != Qt.DisplayRole:
+            return None
+        summary = self.annotationIndex.get(path)
+        if summary is None:
+            return ''
+        if index.column() == 1:
+            return str(summary.objects)
+        if index.column() == 2:
+            return u'ja' if summary.verified else u'nein'
+        return str(summary.edited)
+
+    def summaryChanged(self, imagePath):
+        row = self._rows.get(imagePath)
+        if row is not None:
+            self._changed.add(row)
+            if not self._flushTimer.isActive():
+                self._flushTimer.start()
+
+    def flushChanges(self):
+        if not self._changed:
+            return
+        first, last = min(self._changed), max(self._changed)
+        self._changed.clear()
+        self.dataChanged.emit(self.index(first, 1), self.index(last, len(self.HEADERS) - 1))
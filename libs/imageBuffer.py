@@ -0,0 +1,108 @@
+try:
+    from PyQt5.QtGui import QImage
+except ImportError:
+    from PyQt4.QtGui import QImage
+
+import numpy as np
+from skimage import io
+
+
+def _formats():
+    # (channels, dtype) -> QImage format reading the array memory as is
+    formats = {(1, np.dtype(np.uint8)): QImage.Format_Grayscale8 if hasattr(QImage, 'Format_Grayscale8') else None,
+               (3, np.dtype(np.uint8)): QImage.Format_RGB888,
+               (4, np.dtype(np.uint8)): QImage.Format_RGBA8888 if hasattr(QImage, 'Format_RGBA8888') else None}
+    if hasattr(QImage, 'Format_Grayscale16'):
+        formats[1, np.dtype(np.uint16)] = QImage.Format_Grayscale16
+    if hasattr(QImage, 'Format_RGBA64'):
+        formats[4, np.dtype(np.uint16)] = QImage.Format_RGBA64
+    return dict((k, v) for k, v in formats.items() if v is not None)
+
+
+QIMAGE_FORMATS = _formats()
+
+
+def to8bit(array):
+    """Scale an integer array to uint8 by its maximum, so 12-bit microscopy
+    data uses the full display range."""
+    if array.dtype == np.uint8:
+        return array
+    if array.dtype == np.bool_:
+        return array.astype(np.uint8) * 255
+    if array.dtype.kind == 'f':
+        top = float(array.max()) if array.size else 1.0
+        return np.clip(array * (255.0 / (top if top > 1.0 else 1.0)), 0, 255).astype(np.uint8)
+    top = int(array.max()) if array.size else 0
+    if top <= 255:
+        return np.clip(array, 0, 255).astype(np.uint8)
+    return (array.astype(np.uint32) * 255 // top).astype(np.uint8)
+
+
+class ImageBuffer(object):
+    """Pixels of the opened image, decoded once and shared by the canvas,
+    the detectors, contour calculation and measurements.
+
+    `array` is the decoded image as H x W, H x W x 3 or H x W x 4 array of
+    uint8 or uint16. `image` is a QImage on the same memory wherever Qt has
+    a matching format (8-bit gray, RGB and RGBA, 16-bit gray and RGBA).
+    Other formats, and 16-bit images using less than 15 bits, which would
+    show up almost black, get an 8-bit copy scaled to their maximum for
+    display. The QImage is only valid as long as the buffer is referenced.
+    """
+
+    def __init__(self, array, path=None):
+        self.path = path
+        array = np.asarray(array)
+        if array.ndim == 3 and array.shape[2] in (1, 2):
+            # gray, with alpha
+            array = array[..., 0]
+        if array.dtype not in (np.uint8, np.uint16):
+            array = to8bit(array)
+        # QImage needs packed pixels, rows may not be interleaved
+        self.array = np.ascontiguousarray(array)
+        self._rgb8 = None
+        self._display = self.array
+        channels = 1 if self.array.ndim == 2 else self.array.shape[2]
+        fmt = QIMAGE_FORMATS.get((channels, self.array.dtype))
+        if self.array.dtype == np.uint16 and self.array.size and self.array.max() < 2 ** 15:
+            fmt = None
+        if fmt is None:
+            self._display = np.ascontiguousarray(to8bit(self.array))
+            fmt = QIMAGE_FORMATS.get((channels, self._display.dtype), QImage.Format_RGB888)
+            if channels == 1 and QImage.Format_RGB888 == fmt:
+                self._display = np.ascontiguousarray(np.repeat(self._display[..., None], 3, axis=2))
+        height, width = self.array.shape[:2]
+        self.image = QImage(self._display.data, width, height, self._display.strides[0], fmt)
+
+    @classmethod
+    def read(cls, path):
+        return cls(io.imread(path), path)
+
+    @property
+    def shape(self):
+        """[height, width, depth] as written to the annotation. Like
+        probeImageShape, depth is 1 for gray and 3 for every colour image,
+        with or without alpha."""
+        return [self.array.shape[0], self.array.shape[1], 1 if self.array.ndim == 2 else 3]
+
+    def rgb8(self):
+        """H x W x 3 uint8 pixels as the detectors expect them, the array
+        itself or a view of it for 8-bit RGB(A) images."""
+        if self._rgb8 is None:
+            rgb = to8bit(self.array)
+            if rgb.ndim == 2:
+                rgb = np.repeat(rgb[..., None], 3, axis=2)
+            self._rgb8 = rgb[..., :3]
+        return self._rgb8
+
+    def nbytes(self):
+        """Memory held for the image, counting shared memory once."""
+        arrays = [self.array, self._display]
+        if self._rgb8 is not None:
+            arrays.append(self._rgb8)
+        total, counted = 0, []
+        for a in arrays:
+            if not any(np.may_share_memory(a, b) for b in counted):
+                counted.append(a)
+                total += a.nbytes
+        return total
@@ -3,9 +3,9 @@
 # Edited by Dominik Lueder
 
 try:
-    from PyQt5.QtGui import QImage
+    from PyQt5.QtGui import QImage, QImageReader
 except ImportError:
-    from PyQt4.QtGui import QImage
+    from PyQt4.QtGui import QImage, QImageReader
 
 # import sys
 # from base64 import b64encode, b64decode
@@ -18,6 +18,31 @@ class LabelFileError(Exception):
     pass
 
 
+# path -> (mtime, [height, width, depth])
+_imageShapeCache = {}
+_grayscaleFormats = tuple(getattr(QImage, f) for f in ('Format_Mono', 'Format_MonoLSB', 'Format_Grayscale8', 'Format_Grayscale16') if hasattr(QImage, f))
+
+
+def probeImageShape(imagePath):
+    """Return [height, width, depth] of an image file. Only the header is
+    read where the format allows it, results are cached by path and mtime."""
+    mtime = os.path.getmtime(imagePath)
+    cached = _imageShapeCache.get(imagePath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    reader = QImageReader(imagePath)
+    size = reader.size()
+    if size.isValid():
+        imageShape = [size.height(), size.width(), 1 if reader.imageFormat() in _grayscaleFormats else 3]
+    else:
+        # the format has no header information, decode the whole image
+        image = QImage()
+        image.load(imagePath)
+        imageShape = [image.height(), image.width(), 1 if image.isGrayscale() else 3]
+    _imageShapeCache[imagePath] = mtime, imageShape
+    return imageShape
+
+
 class LabelFile(object):
     # It might be changed as window creates. By default, using XML ext
     # suffix = '.lif'
@@ -29,13 +54,12 @@ class LabelFile(object):
         self.imageData = None
         self.verified = False
 
-    def savePascalVocFormat(self, filename, shapes, imagePath, imageData, lineColor=None, fillColor=None, databaseSrc=None):
+    def savePascalVocFormat(self, filename, shapes, imagePath, imageData, lineColor=None, fillColor=None, databaseSrc=None, imageShape=None):
         imgFolderPath = os.path.dirname(imagePath)
         imgFolderName = os.path.split(imgFolderPath)[-1]
         imgFileName = os.path.basename(imagePath)
-        image = QImage()
-        image.load(imagePath)
-        imageShape = [image.height(), image.width(), 1 if image.isGrayscale() else 3]
+        if imageShape is None:
+            imageShape = probeImageShape(imagePath)
         writer = PascalVocWriter(imgFolderName, imgFileName, imageShape, localImgPath=imagePath)
         writer.verified = self.verified
         for shape in shapes:
@@ -45,8 +69,9 @@ class LabelFile(object):
             contour_points = shape['contour_points']
             confidence = shape['confidence']
             contourEdited = shape['contourEdited']
+            maskLabel = shape.get('maskLabel')
             bndbox = LabelFile.convertPoints2BndBox(points)
-            writer.addBndBox(bndbox[0], bndbox[1], bndbox[2], bndbox[3], label, contour_points, confidence, contourEdited)
+            writer.addBndBox(bndbox[0], bndbox[1], bndbox[2], bndbox[3], label, contour_points, confidence, contourEdited, maskLabel)
 
         writer.save(targetFile=filename)
         return
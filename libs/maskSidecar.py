@@ -0,0 +1,68 @@
+import os
+import numpy as np
+from PIL import Image
+
+# Instance label map of the detection, stored as a 16 bit PNG next to the
+# image. Pixel value i belongs to the object with <maskLabel>i</maskLabel>.
+MASK_EXT = '.masks.png'
+
+
+def sidecarPath(imagePath):
+    return os.path.splitext(imagePath)[0] + MASK_EXT
+
+
+def isSidecar(path):
+    return path.lower().endswith(MASK_EXT)
+
+
+def writeSidecar(imagePath, labels):
+    Image.fromarray(labels.astype(np.uint16)).save(sidecarPath(imagePath), optimize=True)
+
+
+def readSidecar(imagePath):
+    """Return the label map of an image, None if it has no sidecar."""
+    path = sidecarPath(imagePath)
+    if not os.path.isfile(path):
+        return None
+    with Image.open(path) as img:
+        return np.asarray(img).astype(np.uint16)
+
+
+def removeSidecar(imagePath):
+    path = sidecarPath(imagePath)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def maskPixels(labels, maskLabel, xmin, ymin, xmax, ymax):
+    """Image coordinates (rows, cols) of one object, searched in its box."""
+    rr, cc = np.nonzero(labels[ymin:ymax + 1, xmin:xmax + 1] == maskLabel)
+    return rr + ymin, cc + xmin
+
+
+def buildContourPoints(bin_img):
+    points = list()
+    ls = bin_img.astype(np.uint8)
+    left_side, right_side = list(), list()
+    top_side, bottom_side = list(), list()
+    for y in range(ls.shape[0]):
+        try:
+            x_left, x_right = np.where(ls[y, :] == 1)[0][0], np.where(ls[y, :] == 1)[0][-1]
+            left_side.append((y, x_left))
+            right_side.append((y, x_right))
+        except Exception as e:
+            # print(e)
+            continue
+    for x in range(ls.shape[1]):
+        try:
+            y_top, y_bottom = np.where(ls[:, x] == ls[:, x].max())[0][0], np.where(ls[:, x] == ls[:, x].max())[0][-1]
+            top_side.append((y_top, x))
+            bottom_side.append((y_bottom, x))
+        except Exception as e:
+            # print(e)
+            continue
+    points = [x for i, x in enumerate(left_side+list(reversed(right_side))) if (x in top_side+list(reversed(bottom_side)))]
+    if len(points) > 30:
+        points = [x for i,x in enumerate(points) if i % 4 == 0]
+    # points = [x for i, x in enumerate(points) if i % 5 == 0]
+    return points
@@ -0,0 +1,137 @@
+import numpy as np
+from skimage.draw import polygon as rasterPolygon
+
+
+def absoluteContour(xmin, ymin, contour_points):
+    """Return the (row, col) contour of a shape in image coordinates.
+    Contour points are stored as (y, x) relative to the box origin."""
+    cnt = np.asarray(contour_points, dtype=np.float64).reshape(-1, 2)
+    return cnt + (ymin, xmin)
+
+
+def polygonMorphometry(contour_points):
+    """Pixel area (shoelace formula) and perimeter of a contour given as
+    (y, x) points, None for less than 3 points."""
+    if len(contour_points) < 3:
+        return None, None
+    cnt = np.asarray(contour_points, dtype=np.float64).reshape(-1, 2)
+    y, x = cnt[:, 0], cnt[:, 1]
+    area = abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))) / 2
+    perimeter = np.hypot(np.diff(x, append=x[0]), np.diff(y, append=y[0])).sum()
+    return float(area), float(perimeter)
+
+
+class LabelMap:
+    """Instance label map of all cyst contours of one image.
+
+    Label i + 1 belongs to contours[i], 0 is background. Only the union of
+    the contour bounding boxes is rasterized, `origin` holds its (row, col)
+    offset in the image.
+
+    `regions` maps a contour index to exact (rows, cols) pixels, e.g. from
+    the mask sidecar, which are drawn instead of the rasterized contour.
+    The sidecar is a label image, the detector already gave every pixel
+    where its masks overlapped to the detection with the higher confidence,
+    so regions of one sidecar never overlap each other. All other overlaps
+    are resolved by size: the pixel goes to the cyst with the smaller
+    contour, so that cysts lying inside bigger ones stay visible.
+
+    `rawArea` is the pixel area of every rasterized contour on its own,
+    before any overlap is resolved, also for shapes drawn from a region; a
+    region is only counted for a shape without a usable contour.
+    """
+
+    def __init__(self, contours, imageShape, regions=None):
+        height, width = imageShape[0], imageShape[1]
+        self.count = len(contours)
+        self.rawArea = np.zeros(self.count + 1, dtype=np.int64)
+        pixels = [None] * self.count
+        for i, cnt in enumerate(contours):
+            if len(cnt) >= 3:
+                rr, cc = rasterPolygon(cnt[:, 0], cnt[:, 1], shape=(height, width))
+                self.rawArea[i + 1] = len(rr)
+            else:
+                rr, cc = (), ()
+            if regions is not None and i in regions:
+                rr, cc = regions[i]
+                if not self.rawArea[i + 1]:
+                    self.rawArea[i + 1] = len(rr)
+            if len(rr):
+                pixels[i] = rr, cc
+
+        drawn = [p for p in pixels if p is not None]
+        if drawn:
+            r0 = min(rr.min() for rr, cc in drawn)
+            c0 = min(cc.min() for rr, cc in drawn)
+            r1 = max(rr.max() for rr, cc in drawn) + 1
+            c1 = max(cc.max() for rr, cc in drawn) + 1
+        else:
+            r0 = c0 = r1 = c1 = 0
+        self.origin = int(r0), int(c0)
+        dtype = np.uint16 if self.count < np.iinfo(np.uint16).max else np.int32
+        self.labels = np.zeros((int(r1 - r0), int(c1 - c0)), dtype=dtype)
+        for i in np.argsort(-self.rawArea[1:], kind='stable'):
+            if pixels[i] is not None:
+                rr, cc = pixels[i]
+                self.labels[rr - r0, cc - c0] = i + 1
+
+    def crop(self, image):
+        """Return the part of `image` covered by the label map."""
+        r0, c0 = self.origin
+        h, w = self.labels.shape
+        return image[r0:r0 + h, c0:c0 + w]
+
+
+def labelMorphometry(labelMap):
+    """Overlap resolved area and boundary length of every label.
+
+    The boundary length is the number of pixel edges separating a label
+    from any other label or the background. Both values are returned as
+    arrays indexed by label, entry 0 belongs to the background.
+    """
+    n = labelMap.count + 1
+    labels = labelMap.labels
+    area = np.bincount(labels.ravel(), minlength=n)
+    padded = np.pad(labels, 1, mode='constant')
+    horizontal = padded[:, 1:] != padded[:, :-1]
+    vertical = padded[1:, :] != padded[:-1, :]
+    sides = np.concatenate((padded[:, 1:][horizontal], padded[:, :-1][horizontal],
+                            padded[1:, :][vertical], padded[:-1, :][vertical]))
+    boundary = np.bincount(sides, minlength=n)
+    boundary[0] = 0
+    return area, boundary
+
+
+def grayIntensity(image):
+    """Luminance of an RGB(A) image in the original value range, grayscale
+    images, also with alpha or as a single channel, give their gray
+    channel."""
+    if image.ndim == 3 and image.shape[-1] >= 3:
+        return image[..., :3] @ np.array([0.2125, 0.7154, 0.0721])
+    if image.ndim == 3:
+        image = image[..., 0]
+    return image.astype(np.float64)
+
+
+def labelIntensityStats(labelMap, image):
+    """Mean, median and standard deviation of the intensity inside every
+    label, computed with labelled reductions over the whole label map.
+    Labels without pixels get NaN."""
+    n = labelMap.count + 1
+    labels = labelMap.labels.ravel()
+    intensity = grayIntensity(labelMap.crop(image)).ravel()
+    count = np.bincount(labels, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(labels, weights=intensity, minlength=n) / count
+        deviation = (intensity - mean[labels]) ** 2
+        std = np.sqrt(np.bincount(labels, weights=deviation, minlength=n) / count)
+
+    # sorting by label, then by intensity, puts every label in one sorted run
+    values = intensity[np.lexsort((intensity, labels))]
+    starts = np.cumsum(count) - count
+    median = np.full(n, np.nan)
+    filled = count > 0
+    lower = starts[filled] + (count[filled] - 1) // 2
+    upper = starts[filled] + count[filled] // 2
+    median[filled] = (values[lower] + values[upper]) / 2
+    return mean, median, std
@@ -1,14 +1,69 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
+import os
 import sys
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element, SubElement
 from lxml import etree
-import codecs
+from lxml.etree import Element, SubElement
+import numpy as np
+import base64
 import ast
 
 XML_EXT = '.xml'
 ENCODE_METHOD = 'utf-8'
+# contours are stored as base64 of little endian (y, x) pairs, the
+# `encoding` attribute of <contour> names the type. Without the attribute
+# the text is a python literal list of tuples (old format).
+CONTOUR_DTYPES = {'b64-int16': np.dtype('<i2'), 'b64-float32': np.dtype('<f4')}
+
+
+def encodeContour(contour_points):
+    """Return the (encoding, text) of the compact form of a contour."""
+    points = np.asarray(contour_points, dtype=np.float64).reshape(-1, 2)
+    if np.array_equal(np.rint(points), points) and np.all(np.abs(points) <= np.iinfo(np.int16).max):
+        encoding = 'b64-int16'
+    else:
+        encoding = 'b64-float32'
+    data = points.astype(CONTOUR_DTYPES[encoding]).tobytes()
+    return encoding, base64.b64encode(data).decode('ascii')
+
+
+def decodeContour(text, encoding=None):
+    """Parse the text of a <contour> element in either format."""
+    if encoding is None:
+        return ast.literal_eval(text)
+    data = base64.b64decode(text or '')
+    points = np.frombuffer(data, dtype=CONTOUR_DTYPES[encoding]).reshape(-1, 2)
+    return [tuple(p) for p in points.tolist()]
+
+
+def indentTree(elem):
+    """Indent an annotation tree in place with tabs, as the writer always
+    did by pretty printing, and return its root."""
+    if hasattr(etree, 'indent'):
+        for node in elem.iter():
+            if node.text:
+                # the old writer parsed its output again, which folds line
+                # ends, and replaced every double space by a tab
+                node.text = node.text.replace('\r\n', '\n').replace('\r', '\n').replace('  ', '\t')
+        etree.indent(elem, space='\t')
+        elem.tail = '\n'
+        return elem
+    # lxml < 4.5: pretty print once and parse the result again
+    pretty = etree.tostring(elem, pretty_print=True, encoding=ENCODE_METHOD).replace("  ".encode(), "\t".encode())
+    return etree.fromstring(pretty)
+
+
+def writeTree(root, targetFile):
+    """Write an annotation tree in the layout of the writer. It is
+    serialized straight into a temporary file, no intermediate string, and
+    swapped in so a crash never leaves a half written annotation."""
+    tmpFile = targetFile + '.tmp'
+    with open(tmpFile, 'wb') as f:
+        etree.ElementTree(indentTree(root)).write(f, encoding=ENCODE_METHOD)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, targetFile)
+
 
 class PascalVocWriter:
 
@@ -21,16 +76,17 @@ class PascalVocWriter:
         self.localImgPath = localImgPath
         self.verified = False
 
+    def indent(self, elem):
+        """
+            Indent the Element in place with tabs, as pretty printing would.
+        """
+        return indentTree(elem)
+
     def prettify(self, elem):
         """
             Return a pretty-printed XML string for the Element.
         """
-        rough_string = ElementTree.tostring(elem, 'utf8')
-        root = etree.fromstring(rough_string)
-        return etree.tostring(root, pretty_print=True, encoding=ENCODE_METHOD).replace("  ".encode(), "\t".encode())
-        # minidom does not support UTF-8
-        '''reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="\t", encoding=ENCODE_METHOD)'''
+        return etree.tostring(self.indent(elem), encoding=ENCODE_METHOD)
 
     def genXML(self):
         """
@@ -75,13 +131,14 @@ class PascalVocWriter:
         segmented.text = '0'
         return top
 
-    def addBndBox(self, xmin, ymin, xmax, ymax, name, contour_points, confidence, contourEdited):
+    def addBndBox(self, xmin, ymin, xmax, ymax, name, contour_points, confidence, contourEdited, maskLabel=None):
         bndbox = {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax}
         bndbox['name'] = name
         # bndbox['difficult'] = difficult
         bndbox['contour_points'] = contour_points
         bndbox['confidence'] = confidence
         bndbox['contourEdited'] = contourEdited
+        bndbox['maskLabel'] = maskLabel
         self.boxlist.append(bndbox)
 
     def appendObjects(self, top):
@@ -114,35 +171,68 @@ class PascalVocWriter:
             ymax = SubElement(bndbox, 'ymax')
             ymax.text = str(each_object['ymax'])
             contour = SubElement(bndbox, 'contour')
-            contour.text = str(each_object['contour_points'])
+            encoding, text = encodeContour(each_object['contour_points'])
+            # empty contours stay a self-closing element
+            contour.text = text or None
+            contour.set('encoding', encoding)
             confidence = SubElement(bndbox, 'confidence')
             confidence.text = str(each_object['confidence'])
             contourEdited = SubElement(bndbox, 'contourEdited')
             contourEdited.text = str(each_object['contourEdited'])
+            if each_object['maskLabel'] is not None:
+                # value of the object in the <image>.masks.png sidecar
+                maskLabel = SubElement(bndbox, 'maskLabel')
+                maskLabel.text = str(each_object['maskLabel'])
 
     def save(self, targetFile=None):
         root = self.genXML()
         self.appendObjects(root)
-        out_file = None
         if targetFile is None:
-            out_file = codecs.open(
-                self.filename + XML_EXT, 'w', encoding=ENCODE_METHOD)
-        else:
-            out_file = codecs.open(targetFile, 'w', encoding=ENCODE_METHOD)
+            targetFile = self.filename + XML_EXT
+        writeTree(root, targetFile)
+
+
+def parseFlag(text):
+    """Value of a flag such as <contourEdited>, written as True/False but
+    older files may hold any python literal, e.g. 1."""
+    if text is None:
+        return False
+    text = text.strip()
+    if text in ('True', 'False'):
+        return text == 'True'
+    try:
+        return bool(ast.literal_eval(text))
+    except Exception:
+        return False
+
 
-        prettifyResult = self.prettify(root)
-        out_file.write(prettifyResult.decode('utf8'))
-        out_file.close()
+class LazyContour(object):
+    """Contour of a streamed object that is decoded only when asked for."""
+    __slots__ = ('text', 'encoding')
+
+    def __init__(self, text, encoding):
+        self.text = text
+        self.encoding = encoding
+
+    def points(self):
+        try:
+            return decodeContour(self.text, self.encoding)
+        except Exception:
+            return list()
 
 
 class PascalVocReader:
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, lazy=False):
         # shapes type:
-        # [labbel, [(x1,y1), (x2,y2), (x3,y3), (x4,y4)], color, color, difficult]
+        # [label, [(x1,y1), (x2,y2), (x3,y3), (x4,y4)], color, color, contour_points, confidence, contourEdited]
         self.shapes = []
         self.filepath = filepath
         self.verified = False
+        self.imgSize = None
+        if lazy:
+            # nothing is read until iterShapes() or countObjects() is called
+            return
         try:
             self.parseXML()
         except:
@@ -151,45 +241,70 @@ class PascalVocReader:
     def getShapes(self):
         return self.shapes
 
-    def addShape(self, label, bndbox):
+    def parseShape(self, label, bndbox, decodeContours=True):
         xmin = int(bndbox.find('xmin').text)
         ymin = int(bndbox.find('ymin').text)
         xmax = int(bndbox.find('xmax').text)
         ymax = int(bndbox.find('ymax').text)
-        try:
-            contour_points = ast.literal_eval(bndbox.find('contour').text)
-        except Exception as e:
-            # print(e)
+        contour = bndbox.find('contour')
+        if contour is None:
             contour_points = list()
+        elif decodeContours:
+            contour_points = LazyContour(contour.text, contour.get('encoding')).points()
+        else:
+            contour_points = LazyContour(contour.text, contour.get('encoding'))
         try:
             confidence = float(bndbox.find('confidence').text)
         except Exception as e:
             confidence = 1.00
-        try:
-            contourEdited = ast.literal_eval(bndbox.find('contourEdited').text)
-        except Exception as e:
-            contourEdited = False
+        contourEdited = parseFlag(bndbox.findtext('contourEdited'))
+        maskLabel = bndbox.findtext('maskLabel')
+        if maskLabel is not None:
+            maskLabel = int(maskLabel)
         points = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
-        self.shapes.append((label, points, None, None, contour_points, confidence, contourEdited))
+        return (label, points, None, None, contour_points, confidence, contourEdited, maskLabel)
 
-    def parseXML(self):
+    def addShape(self, label, bndbox):
+        self.shapes.append(self.parseShape(label, bndbox))
+
+    def iterShapes(self, decodeContours=True):
+        """Stream the objects of the file as shape tuples, the document is
+        read only as far as the caller iterates. With decodeContours=False
+        the contour is a LazyContour, decoded by its points() method.
+        verified and imgSize are set once the first shape is yielded."""
         assert self.filepath.endswith(XML_EXT), "Unsupport file format"
-        parser = etree.XMLParser(encoding=ENCODE_METHOD)
-        xmltree = ElementTree.parse(self.filepath, parser=parser).getroot()
-        filename = xmltree.find('filename').text
-        try:
-            verified = xmltree.attrib['verified']
-            if verified == 'yes':
-                self.verified = True
-        except KeyError:
-            self.verified = False
-
-        for object_iter in xmltree.findall('object'):
-            bndbox = object_iter.find("bndbox")
-            label = object_iter.find('name').text
-            # # Add chris
-            # difficult = False
-            # if object_iter.find('difficult') is not None:
-            #     difficult = bool(int(object_iter.find('difficult').text))
-            self.addShape(label, bndbox)
+        with open(self.filepath, 'rb') as f:
+            for event, elem in etree.iterparse(f, events=('start', 'end'), encoding=ENCODE_METHOD):
+                if event == 'start':
+                    if elem.tag == 'annotation':
+                        self.verified = elem.get('verified') == 'yes'
+                    continue
+                if elem.tag == 'size':
+                    self.imgSize = [int(elem.findtext(t, '0')) for t in ('height', 'width', 'depth')]
+                elif elem.tag == 'object':
+                    shape = self.parseShape(elem.findtext('name'), elem.find('bndbox'), decodeContours)
+                    # drop the parsed objects, memory stays flat for big files
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+                    yield shape
+
+    def countObjects(self):
+        count = 0
+        with open(self.filepath, 'rb') as f:
+            for event, elem in etree.iterparse(f, events=('start', 'end'), tag=('annotation', 'object'), encoding=ENCODE_METHOD):
+                if event == 'start':
+                    if elem.tag == 'annotation':
+                        self.verified = elem.get('verified') == 'yes'
+                elif elem.tag == 'object':
+                    count += 1
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        return count
+
+    def parseXML(self):
+        # all or nothing, a truncated file must not open with part of its
+        # shapes, the next save would drop the rest
+        self.shapes = list(self.iterShapes())
         return True
@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.imageBuffer import ImageBuffer
+from libs.pascal_voc_io import PascalVocReader
+
+# images kept decoded at once, the current one is not part of the cache
+PREFETCH_CACHE_SIZE = 6
+# upper bound for the decoded images held by the cache, a few large slides
+# fill it before the count does
+PREFETCH_CACHE_BYTES = 512 * 1024 * 1024
+
+LoadedImage = namedtuple('LoadedImage', 'stamp buffer shapes verified')
+
+
+def fileStamp(imagePath, annotationPath):
+    """mtimes of an image and its annotation, a cached entry is only used
+    while they are unchanged."""
+    annotationTime = os.path.getmtime(annotationPath) if os.path.isfile(annotationPath) else None
+    return os.path.getmtime(imagePath), annotationTime
+
+
+def loadImage(imagePath, annotationPath):
+    """Decode an image into an ImageBuffer and parse its annotation, safe
+    to run in any thread. The buffer is None if the image could not be
+    read."""
+    stamp = fileStamp(imagePath, annotationPath)
+    try:
+        buffer = ImageBuffer.read(imagePath)
+    except Exception as e:
+        logging.error('Reading {0} failed: {1}'.format(imagePath, e))
+        return LoadedImage(stamp, None, None, False)
+    shapes, verified = None, False
+    if stamp[1] is not None:
+        reader = PascalVocReader(annotationPath)
+        shapes, verified = reader.getShapes(), reader.verified
+    return LoadedImage(stamp, buffer, shapes, verified)
+
+
+def loadedBytes(future):
+    """Memory of the image decoded by a prefetch, 0 while it is loading."""
+    if not future.done() or future.cancelled() or future.exception() is not None:
+        return 0
+    buffer = future.result().buffer
+    return buffer.nbytes() if buffer is not None else 0
+
+
+class ImagePrefetcher(object):
+    """Loads the neighbours of the current image in the background.
+
+    prefetch() is given the paths that are likely opened next, nearest
+    first. They are loaded by a small thread pool into a LRU cache; take()
+    returns the entry of a path, waiting for it if it is still loading, or
+    None if it was never requested or its files changed since. The cache
+    holds at most maxItems entries and, once they are decoded, maxBytes of
+    image buffers; the least recently requested entries are dropped first.
+    """
+
+    def __init__(self, annotationPath, workers=2, maxItems=PREFETCH_CACHE_SIZE, maxBytes=PREFETCH_CACHE_BYTES):
+        self.annotationPath = annotationPath
+        self.maxItems = maxItems
+        self.maxBytes = maxBytes
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        # reentrant, a callback of a future that is already done runs at once
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+
+    def _load(self, imagePath):
+        return loadImage(imagePath, self.annotationPath(imagePath))
+
+    def prefetch(self, imagePaths):
+        with self._lock:
+            for imagePath in imagePaths:
+                if imagePath not in self._entries:
+                    future = self._entries[imagePath] = self._pool.submit(self._load, imagePath)
+                    # the size is known once the image is decoded
+                    future.add_done_callback(self._loaded)
+            # the nearest neighbours are the most recent entries
+            for imagePath in reversed(imagePaths):
+                if imagePath in self._entries:
+                    self._entries.move_to_end(imagePath)
+            while len(self._entries) > self.maxItems:
+                imagePath, future = self._entries.popitem(last=False)
+                future.cancel()
+            self._evict()
+
+    def _loaded(self, future):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # called with the lock held; entries still loading count as empty
+        sizes = [(imagePath, loadedBytes(future)) for imagePath, future in self._entries.items()]
+        total = sum(size for imagePath, size in sizes)
+        for imagePath, size in sizes:
+            if total <= self.maxBytes:
+                break
+            if size:
+                del self._entries[imagePath]
+                total -= size
+
+    def take(self, imagePath):
+        with self._lock:
+            future = self._entries.pop(imagePath, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            entry = future.result()
+        except Exception as e:
+            logging.error('Prefetching {0} failed: {1}'.format(imagePath, e))
+            return None
+        try:
+            if entry.stamp != fileStamp(imagePath, self.annotationPath(imagePath)):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def clear(self):
+        with self._lock:
+            for future in self._entries.values():
+                future.cancel()
+            self._entries.clear()
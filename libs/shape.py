@@ -7,7 +7,18 @@ except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
 from libs.lib import distance
-import sys
+import numpy as np
+
+
+def arrayToPolygon(xy):
+    """QPolygonF of an (N, 2) array of x, y, filled through its buffer."""
+    polygon = QPolygonF(len(xy))
+    if len(xy):
+        ptr = polygon.data()
+        ptr.setsize(len(xy) * 2 * np.dtype(np.float64).itemsize)
+        np.frombuffer(ptr, np.float64).reshape(-1, 2)[:] = xy
+    return polygon
+
 
 # DEFAULT_LINE_COLOR = QColor(0, 255, 0, 128)
 DEFAULT_LINE_COLOR = QColor(255, 255, 255, 255)
@@ -40,9 +51,16 @@ class Shape(object):
     point_type = P_ROUND
     point_size = 8
     scale = 1.0
+    # pens and the label font are shared by all shapes
+    _pens = {}
+    _font = None
 
     def __init__(self, label=None, line_color=None, confidence=1.0):
         self.label = label
+        # Paths, polygon and bounds built from the points and the contour
+        # are cached until version changes, see invalidate().
+        self.version = 0
+        self._cache = {}
         # points = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
         self.points = list()
         self.contour_points = list()
@@ -51,6 +69,8 @@ class Shape(object):
         self.selected = False
         # self.difficult = difficult
         self.contourEdited = False
+        # object in the mask sidecar, None once the box no longer matches it
+        self.maskLabel = None
 
         self._highlightIndex = None
         self._highlightMode = self.NEAR_VERTEX
@@ -67,8 +87,34 @@ class Shape(object):
             # is used for drawing the pending line a different color.
             self.line_color = line_color
 
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = points
+        self.invalidate()
+
+    @property
+    def contour_points(self):
+        return self._contour_points
+
+    @contour_points.setter
+    def contour_points(self, contour_points):
+        # (N, 2) float array of (y, x) relative to the box origin
+        self._contour_points = np.array(contour_points, dtype=np.float64).reshape(-1, 2)
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached geometry, must be called after changing points
+        or contour_points in place."""
+        self.version += 1
+        self._cache.clear()
+
     def close(self):
         self._closed = True
+        self.invalidate()
 
     def reachMaxPoints(self):
         if len(self.points) >= 4:
@@ -78,13 +124,39 @@ class Shape(object):
     def addPoint(self, point):
         if not self.reachMaxPoints():
             self.points.append(point)
+            self.invalidate()
 
     def addContourPoint(self, point):
-        self.contour_points.append(point)
+        self.contour_points = np.vstack((self._contour_points, point))
+
+    def nearestContourPoint(self, y, x, epsilon):
+        """Index of the contour point closest to (y, x) relative to the box
+        origin, None if none is closer than epsilon."""
+        if not len(self._contour_points):
+            return None
+        d = np.hypot(self._contour_points[:, 0] - y, self._contour_points[:, 1] - x)
+        i = int(np.argmin(d))
+        return i if d[i] < epsilon else None
+
+    def translateContour(self, dy, dx):
+        self._contour_points += (dy, dx)
+        self.invalidate()
+
+    def deformContour(self, index, dy, dx, stiffness, reach=3):
+        """Drag contour point `index` by (dy, dx), its `reach` neighbours on
+        both sides follow with a falloff of 1 / (1 + stiffness * distance)."""
+        cnt = self._contour_points
+        neighbours = np.unique(np.arange(index - reach, index + reach + 1) % len(cnt))
+        d = np.hypot(*(cnt[neighbours] - cnt[index]).T)
+        f = 1 / (1 + stiffness * d)
+        cnt[neighbours] += f[:, None] * (dy, dx)
+        self.invalidate()
 
     def popPoint(self):
         if self.points:
-            return self.points.pop()
+            point = self.points.pop()
+            self.invalidate()
+            return point
         return None
 
     def isClosed(self):
@@ -92,53 +164,102 @@ class Shape(object):
 
     def setOpen(self):
         self._closed = False
+        self.invalidate()
 
-    def paint(self, painter):
-        if self.points:
-            # color = self.select_line_color if self.selected else self.line_color
-            if self.selected:
-                color = self.select_line_color
-            elif not self.selected and self.contourEdited:
-                color = self.line_color_edited
-            else:
-                color = self.line_color
-            pen = QPen(color)
-            pen.setWidth(max(1, int(round(2.0 / self.scale))))
-            painter.setPen(pen)
-            line_path = QPainterPath()
-            vrtx_path = QPainterPath()
-            line_path.moveTo(self.points[0])
-            for i, p in enumerate(self.points):
-                line_path.lineTo(p)
-                self.drawVertex(vrtx_path, i)
+    def _cached(self, key, build):
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = build()
+        return value
+
+    @classmethod
+    def pen(cls, color, width):
+        key = (color.rgba(), width)
+        pen = cls._pens.get(key)
+        if pen is None:
+            pen = cls._pens[key] = QPen(color)
+            pen.setWidth(width)
+        return pen
+
+    @classmethod
+    def labelFont(cls):
+        if cls._font is None:
+            cls._font = QFont()
+            cls._font.setPointSize(8)
+            cls._font.setBold(True)
+        return cls._font
+
+    def linePath(self):
+        """Outline of the box as drawn, closed once the shape is closed."""
+        def build():
+            path = QPainterPath()
+            path.moveTo(self.points[0])
+            for p in self.points:
+                path.lineTo(p)
             if self.isClosed():
-                line_path.lineTo(self.points[0])
+                path.lineTo(self.points[0])
+            return path
+        return self._cached('line', build)
+
+    def vertexPath(self, highlight=True):
+        highlightIndex = self._highlightIndex if highlight else None
+        key = (self.scale, highlightIndex, self._highlightMode)
+        cached = self._cache.get('vertices')
+        if cached is None or cached[0] != key:
+            path = QPainterPath()
+            for i in range(len(self.points)):
+                self.drawVertex(path, i, highlightIndex)
+            cached = self._cache['vertices'] = key, path
+        return cached[1]
+
+    def labelPosition(self):
+        return self._cached('labelPos', lambda: self.boundingRect().topLeft())
+
+    def contourPolygon(self):
+        """Contour in image coordinates, contour points are (y, x)
+        relative to the integer box origin."""
+        def build():
+            xmin, ymin = int(self.points[0].x()), int(self.points[0].y())
+            return arrayToPolygon(self._contour_points[:, ::-1] + (xmin, ymin))
+        return self._cached('contour', build)
+
+    def contourBounds(self):
+        return self._cached('contourBounds', lambda: self.contourPolygon().boundingRect())
+
+    def lineColor(self):
+        # color = self.select_line_color if self.selected else self.line_color
+        if self.selected:
+            return self.select_line_color
+        elif self.contourEdited:
+            return self.line_color_edited
+        return self.line_color
+
+    def paint(self, painter, highlight=True):
+        """Draw the shape, with highlight=False without the highlighted
+        vertex, the way it looks when the cursor is elsewhere."""
+        if self.points:
+            color = self.lineColor()
+            painter.setPen(self.pen(color, max(1, int(round(2.0 / self.scale)))))
+            line_path = self.linePath()
+            vrtx_path = self.vertexPath(highlight)
+            self.vertex_fill_color = self.hvertex_fill_color if highlight and self._highlightIndex is not None else Shape.vertex_fill_color
             painter.drawPath(line_path)
             painter.drawPath(vrtx_path)
             painter.fillPath(vrtx_path, self.vertex_fill_color)
-            min_x = sys.maxsize
-            min_y = sys.maxsize
-            for point in self.points:
-                min_x = min(min_x, point.x())
-                min_y = min(min_y, point.y())
-            if min_x != sys.maxsize and min_y != sys.maxsize:
-                font = QFont()
-                font.setPointSize(8)
-                font.setBold(True)
-                painter.setFont(font)
-                painter.drawText(min_x, min_y, str(self.confidence))
+            painter.setFont(self.labelFont())
+            painter.drawText(self.labelPosition(), str(self.confidence))
             if self.fill:
                 color = self.select_fill_color if self.selected else self.fill_color
                 painter.fillPath(line_path, color)
 
-    def drawVertex(self, path, i):
+    def drawVertex(self, path, i, highlightIndex=None):
         d = self.point_size / self.scale
         shape = self.point_type
         point = self.points[i]
-        if i == self._highlightIndex:
+        if i == highlightIndex:
             size, shape = self._highlightSettings[self._highlightMode]
             d *= size
-        if self._highlightIndex is not None:
+        if highlightIndex is not None:
             self.vertex_fill_color = self.hvertex_fill_color
         else:
             self.vertex_fill_color = Shape.vertex_fill_color
@@ -159,19 +280,24 @@ class Shape(object):
         return self.makePath().contains(point)
 
     def makePath(self):
-        path = QPainterPath(self.points[0])
-        for p in self.points[1:]:
-            path.lineTo(p)
-        return path
+        def build():
+            path = QPainterPath(self.points[0])
+            for p in self.points[1:]:
+                path.lineTo(p)
+            return path
+        return self._cached('path', build)
 
     def boundingRect(self):
-        return self.makePath().boundingRect()
+        return self._cached('bounds', lambda: self.makePath().boundingRect())
 
     def moveBy(self, offset):
         self.points = [p + offset for p in self.points]
+        self.maskLabel = None
 
     def moveVertexBy(self, i, offset):
         self.points[i] = self.points[i] + offset
+        self.invalidate()
+        self.maskLabel = None
 
     def highlightVertex(self, i, action):
         self._highlightIndex = i
@@ -201,3 +327,4 @@ class Shape(object):
 
     def __setitem__(self, key, value):
         self.points[key] = value
+        self.invalidate()
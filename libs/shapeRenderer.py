@@ -0,0 +1,91 @@
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+from libs.shape import Shape
+
+
+class ShapeRenderer(object):
+    """Draws many shapes in their resting look with a few painter calls.
+
+    Shapes are grouped by line color. Every group gets one drawRects call
+    for the box outlines and one drawPixmapFragments call placing a
+    pre-rendered vertex marker on every corner. Confidence labels are
+    QStaticText objects cached by their text. The result matches what
+    Shape.paint(painter, highlight=False) draws for every shape.
+    """
+
+    def __init__(self):
+        self._texts = {}
+        self._markers = {}
+        self._ascent = None
+
+    def staticText(self, text):
+        staticText = self._texts.get(text)
+        if staticText is None:
+            staticText = self._texts[text] = QStaticText(text)
+            staticText.setPerformanceHint(QStaticText.AggressiveCaching)
+        return staticText
+
+    def marker(self, color, lineWidth, scale):
+        """Vertex marker in device pixels, outlined in `color` and filled
+        like Shape.paint does it."""
+        key = (color.rgba(), Shape.vertex_fill_color.rgba(), Shape.point_type, Shape.point_size, lineWidth * scale)
+        marker = self._markers.get(key)
+        if marker is None:
+            d, w = Shape.point_size, lineWidth * scale
+            size = int(d + w) + 2
+            path = QPainterPath()
+            center = QPointF(size / 2.0, size / 2.0)
+            if Shape.point_type == Shape.P_SQUARE:
+                path.addRect(center.x() - d / 2, center.y() - d / 2, d, d)
+            else:
+                path.addEllipse(center, d / 2.0, d / 2.0)
+            marker = QPixmap(size, size)
+            marker.fill(Qt.transparent)
+            p = QPainter(marker)
+            p.setRenderHint(QPainter.Antialiasing)
+            p.setPen(Shape.pen(color, max(1, int(round(w)))))
+            p.drawPath(path)
+            p.fillPath(path, Shape.vertex_fill_color)
+            p.end()
+            marker = self._markers[key] = marker
+        return marker
+
+    def paintShapes(self, painter, shapes, scale):
+        groups = {}
+        for shape in shapes:
+            if shape.points:
+                color = shape.lineColor()
+                groups.setdefault(color.rgba(), (color, []))[1].append(shape)
+        lineWidth = max(1, int(round(2.0 / scale)))
+        painter.setBrush(Qt.NoBrush)
+        for color, group in groups.values():
+            painter.setPen(Shape.pen(color, lineWidth))
+            painter.drawRects([shape.boundingRect() for shape in group])
+            marker = self.marker(color, lineWidth, scale)
+            source = QRectF(marker.rect())
+            # markers keep their size in device pixels at every zoom
+            painter.drawPixmapFragments([QPainter.PixmapFragment.create(point, source, 1.0 / scale, 1.0 / scale)
+                                         for shape in group for point in shape.points], marker)
+            self.paintLabels(painter, group)
+
+    def paintLabels(self, painter, shapes):
+        font = Shape.labelFont()
+        painter.setFont(font)
+        if self._ascent is None:
+            self._ascent = QFontMetricsF(font).ascent()
+        for shape in shapes:
+            # drawText places the baseline at the position, static text its
+            # top left corner
+            position = shape.labelPosition()
+            painter.drawStaticText(QPointF(position.x(), position.y() - self._ascent), self.staticText(str(shape.confidence)))
+
+    def paintContours(self, painter, shapes, color):
+        painter.setPen(color)
+        painter.setBrush(Qt.NoBrush)
+        for shape in shapes:
+            painter.drawPolygon(shape.contourPolygon())
@@ -0,0 +1,112 @@
+import math
+
+
+class GridIndex(object):
+    """Uniform grid over the image holding the bounds of every shape.
+
+    Every shape is stored in all cells its bounds touch, so looking up a
+    point only has to test the shapes of one cell. Shapes also get an order
+    number when inserted; shapes are only ever appended to the canvas, so
+    sorting by it gives the drawing order without searching the shape list.
+    """
+
+    def __init__(self, cellSize=128):
+        self.cellSize = cellSize
+        self._cells = {}
+        self._keys = {}
+        self._order = {}
+        self._next = 0
+
+    def clear(self):
+        self._cells = {}
+        self._keys = {}
+        self._order = {}
+        self._next = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, shape):
+        return shape in self._keys
+
+    @staticmethod
+    def bounds(shape):
+        rect = shape.boundingRect()
+        return rect.left(), rect.top(), rect.right(), rect.bottom()
+
+    def _cellRange(self, x0, y0, x1, y1):
+        s = self.cellSize
+        return range(int(math.floor(x0 / s)), int(math.floor(x1 / s)) + 1), \
+            range(int(math.floor(y0 / s)), int(math.floor(y1 / s)) + 1)
+
+    def insert(self, shape):
+        if shape in self._keys:
+            self.update(shape)
+            return
+        self._order[shape] = self._next
+        self._next += 1
+        self._add(shape)
+
+    def _add(self, shape):
+        if not shape.points:
+            self._keys[shape] = ()
+            return
+        cols, rows = self._cellRange(*self.bounds(shape))
+        keys = tuple((c, r) for c in cols for r in rows)
+        for key in keys:
+            self._cells.setdefault(key, set()).add(shape)
+        self._keys[shape] = keys
+
+    def _discard(self, shape):
+        for key in self._keys.pop(shape, ()):
+            cell = self._cells[key]
+            cell.discard(shape)
+            if not cell:
+                del self._cells[key]
+
+    def update(self, shape):
+        """Re-index a shape after it was moved or resized."""
+        if shape not in self._keys:
+            self.insert(shape)
+            return
+        self._discard(shape)
+        self._add(shape)
+
+    def remove(self, shape):
+        self._discard(shape)
+        self._order.pop(shape, None)
+
+    def rebuild(self, shapes):
+        self.clear()
+        for shape in shapes:
+            self.insert(shape)
+
+    def order(self, shape):
+        return self._order[shape]
+
+    def query(self, x0, y0, x1, y1):
+        """Shapes whose bounds may intersect the rectangle, topmost first."""
+        cols, rows = self._cellRange(x0, y0, x1, y1)
+        found = set()
+        if len(cols) * len(rows) > len(self._cells):
+            for key, cell in self._cells.items():
+                if key[0] in cols and key[1] in rows:
+                    found.update(cell)
+        else:
+            for c in cols:
+                for r in rows:
+                    cell = self._cells.get((c, r))
+                    if cell:
+                        found.update(cell)
+        return sorted(found, key=self._order.__getitem__, reverse=True)
+
+    def candidates(self, point, margin=0.0):
+        """Shapes whose bounds, grown by `margin`, contain the point,
+        topmost first."""
+        x, y = point.x(), point.y()
+        result = []
+        for shape in self.query(x - margin, y - margin, x + margin, y + margin):
+            x0, y0, x1, y1 = self.bounds(shape)
+            if x0 - margin <= x <= x1 + margin and y0 - margin <= y <= y1 + margin:
+                result.append(shape)
+        return result
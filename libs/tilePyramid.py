@@ -0,0 +1,128 @@
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+except ImportError:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+import math
+import threading
+from collections import OrderedDict
+
+TILE_SIZE = 512
+# upper bound for the pixmaps of all tiles kept at once
+TILE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class TilePyramid(QObject):
+    """Image shown by the canvas, split into tiles on several resolutions.
+
+    Level 0 is the image itself, every further level halves the previous
+    one until it fits into one tile. Levels are computed as QImages in a
+    background thread; `levelReady` is emitted for every finished level.
+    Tiles become QPixmaps only when they are drawn, which has to happen on
+    the GUI thread, and are kept in a LRU cache.
+
+    width(), height(), size(), rect() and isNull() behave like the ones of
+    the QPixmap the canvas used before.
+
+    The image is used as it is, without conversion. A QImage on foreign
+    memory, e.g. the one of an ImageBuffer, must come with the `owner` of
+    that memory, which is kept alive as long as the pyramid.
+    """
+    levelReady = pyqtSignal(int)
+
+    def __init__(self, image=None, parent=None, owner=None):
+        super(TilePyramid, self).__init__(parent)
+        if image is None:
+            image = QImage()
+        self.owner = owner
+        self._levels = [image]
+        self._tiles = OrderedDict()
+        self._cacheBytes = 0
+        self._cancelled = False
+        if not image.isNull() and max(image.width(), image.height()) > TILE_SIZE:
+            threading.Thread(target=self._build, daemon=True).start()
+
+    def _build(self):
+        level = self._levels[0]
+        while max(level.width(), level.height()) > TILE_SIZE and not self._cancelled:
+            level = level.scaled(max(1, level.width() // 2), max(1, level.height() // 2),
+                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            # list.append is atomic, readers only ever see finished levels
+            self._levels.append(level)
+            self.levelReady.emit(len(self._levels) - 1)
+
+    def cancel(self):
+        """Stop building levels and drop all tiles."""
+        self._cancelled = True
+        self._tiles.clear()
+        self._cacheBytes = 0
+
+    def isNull(self):
+        return self._levels[0].isNull()
+
+    def __bool__(self):
+        return not self.isNull()
+
+    __nonzero__ = __bool__
+
+    def width(self):
+        return self._levels[0].width()
+
+    def height(self):
+        return self._levels[0].height()
+
+    def size(self):
+        return self._levels[0].size()
+
+    def rect(self):
+        return self._levels[0].rect()
+
+    def levelCount(self):
+        return len(self._levels)
+
+    def levelFor(self, scale):
+        """The coarsest finished level that still has at least one pixel
+        per screen pixel at `scale`."""
+        if scale <= 0:
+            return len(self._levels) - 1
+        level = int(math.floor(math.log(1.0 / scale, 2))) if scale < 1 else 0
+        return max(0, min(level, len(self._levels) - 1))
+
+    def tile(self, level, col, row):
+        key = level, col, row
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+        image = self._levels[level]
+        x, y = col * TILE_SIZE, row * TILE_SIZE
+        pixmap = QPixmap.fromImage(image.copy(x, y, min(TILE_SIZE, image.width() - x), min(TILE_SIZE, image.height() - y)))
+        self._tiles[key] = pixmap
+        self._cacheBytes += pixmap.width() * pixmap.height() * 4
+        while self._cacheBytes > TILE_CACHE_BYTES and len(self._tiles) > 1:
+            old, oldPixmap = self._tiles.popitem(last=False)
+            self._cacheBytes -= oldPixmap.width() * oldPixmap.height() * 4
+        return pixmap
+
+    def draw(self, painter, rect, scale):
+        """Draw the part of the image inside `rect`, given in image
+        coordinates, with the tiles of the level matching `scale`."""
+        if self.isNull():
+            return
+        rect = rect.intersected(QRectF(self.rect()))
+        if rect.isEmpty():
+            return
+        level = self.levelFor(scale)
+        image = self._levels[level]
+        fx = self.width() / float(image.width())
+        fy = self.height() / float(image.height())
+        tx, ty = TILE_SIZE * fx, TILE_SIZE * fy
+        cols = range(int(rect.left() // tx), min(int(rect.right() // tx) + 1, int(math.ceil(image.width() / float(TILE_SIZE)))))
+        rows = range(int(rect.top() // ty), min(int(rect.bottom() // ty) + 1, int(math.ceil(image.height() / float(TILE_SIZE)))))
+        for row in rows:
+            for col in cols:
+                pixmap = self.tile(level, col, row)
+                target = QRectF(col * tx, row * ty, pixmap.width() * fx, pixmap.height() * fy)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
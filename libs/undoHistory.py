@@ -0,0 +1,161 @@
+try:
+    from PyQt5.QtCore import QPointF
+except ImportError:
+    from PyQt4.QtCore import QPointF
+
+from collections import namedtuple
+import numpy as np
+
+# upper bound for the states held by all undo and redo steps
+UNDO_MEMORY_BYTES = 32 * 1024 * 1024
+# rough size of a state without its contour
+STATE_OVERHEAD = 400
+
+ShapeState = namedtuple('ShapeState', 'version label points contour confidence contourEdited maskLabel')
+
+
+def shapeState(shape, previous=None):
+    """Immutable state of a shape. The contour array is shared with
+    `previous` if it did not change, so moving a box does not copy it."""
+    contour = shape.contour_points
+    if previous is not None and np.array_equal(previous.contour, contour):
+        contour = previous.contour
+    else:
+        contour = contour.copy()
+        contour.flags.writeable = False
+    return ShapeState(shape.version, shape.label, tuple((p.x(), p.y()) for p in shape.points), contour,
+                      shape.confidence, shape.contourEdited, shape.maskLabel)
+
+
+def unchanged(state, shape):
+    # label and flags are not covered by the version of the shape
+    return state.version == shape.version and state.label == shape.label and \
+        state.confidence == shape.confidence and state.contourEdited == shape.contourEdited and \
+        state.maskLabel == shape.maskLabel
+
+
+def applyState(shape, state):
+    shape.label = state.label
+    shape.points = [QPointF(x, y) for x, y in state.points]
+    shape.contour_points = state.contour
+    shape.confidence = state.confidence
+    shape.contourEdited = state.contourEdited
+    shape.maskLabel = state.maskLabel
+
+
+class UndoStep(object):
+    """Changes of one edit as (shape, index, before, after); before is None
+    for created and after is None for deleted shapes."""
+
+    def __init__(self, changes, nbytes, merge=False):
+        self.changes = changes
+        self.nbytes = nbytes
+        self.merge = merge
+
+    def shapes(self):
+        return [c[0] for c in self.changes]
+
+
+class UndoHistory(object):
+    """Undo and redo of shape edits.
+
+    record() compares the shapes with the states stored by the previous
+    call and only keeps the shapes whose version changed, so a step costs
+    the changed shapes, not the whole image. States are shared between
+    neighbouring steps, a step only pays for the states it creates. The
+    oldest steps are dropped once all steps hold more than maxBytes.
+    """
+
+    def __init__(self, maxBytes=UNDO_MEMORY_BYTES):
+        self.maxBytes = maxBytes
+        self.reset([])
+
+    def reset(self, shapes):
+        """Forget all steps and take `shapes` as the current state."""
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+        self._order = list(shapes)
+        self._states = dict((shape, shapeState(shape)) for shape in shapes)
+
+    def canUndo(self):
+        return bool(self._undo)
+
+    def canRedo(self):
+        return bool(self._redo)
+
+    def nbytes(self):
+        return self._bytes
+
+    def record(self, shapes, merge=False):
+        """Store the changes since the last call as one step. With merge=True
+        the step is joined with the previous one if that also was a merge
+        step of the same shapes, e.g. for repeated arrow key moves."""
+        current = set(shapes)
+        previous = set(self._order)
+        changes = []
+        nbytes = 0
+        for index, shape in enumerate(self._order):
+            if shape not in current:
+                changes.append((shape, index, self._states.pop(shape), None))
+        for index, shape in enumerate(shapes):
+            before = self._states.get(shape) if shape in previous else None
+            if before is not None and unchanged(before, shape):
+                continue
+            after = shapeState(shape, before)
+            if before is None or after.contour is not before.contour:
+                nbytes += after.contour.nbytes
+            nbytes += STATE_OVERHEAD
+            self._states[shape] = after
+            changes.append((shape, index, before, after))
+        self._order = list(shapes)
+        if not changes:
+            return None
+        last = self._undo[-1] if self._undo else None
+        if merge and last is not None and last.merge and last.shapes() == [c[0] for c in changes]:
+            # keep the state before the first of the merged steps
+            last.changes = [(shape, index, old[2], after) for old, (shape, index, before, after) in zip(last.changes, changes)]
+            self._bytes += nbytes
+            last.nbytes += nbytes
+        else:
+            self._undo.append(UndoStep(changes, nbytes, merge))
+            self._bytes += nbytes
+        for step in self._redo:
+            self._bytes -= step.nbytes
+        self._redo = []
+        while self._bytes > self.maxBytes and len(self._undo) > 1:
+            self._bytes -= self._undo.pop(0).nbytes
+        return changes
+
+    def undo(self, shapes):
+        """Revert the last step on the list `shapes` in place and return its
+        changes, None if there is nothing to undo."""
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        self._redo.append(step)
+        self._apply(shapes, [(shape, index, after, before) for shape, index, before, after in step.changes])
+        return step.changes
+
+    def redo(self, shapes):
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        self._undo.append(step)
+        self._apply(shapes, step.changes)
+        return step.changes
+
+    def _apply(self, shapes, changes):
+        # remove first, then insert by ascending index, which restores the
+        # order the shapes had when the step was recorded
+        removed = set(shape for shape, index, old, new in changes if new is None)
+        shapes[:] = [s for s in shapes if s not in removed]
+        for shape, index, old, new in sorted(changes, key=lambda c: c[1]):
+            if new is None:
+                self._states.pop(shape, None)
+                continue
+            if old is None:
+                shapes.insert(min(index, len(shapes)), shape)
+            applyState(shape, new)
+            self._states[shape] = new._replace(version=shape.version)
+        self._order = list(shapes)
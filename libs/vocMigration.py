@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""Convert the contours of existing annotation files to the compact encoding.
+
+    python -m libs.vocMigration [-j JOBS] FOLDER [FOLDER ...]
+
+Every annotation below the given folders is rewritten in place (through a
+temporary file) in the layout of the writer. Files that are already
+converted and XML files that are no annotation are left untouched, as are
+contours whose text cannot be parsed; those are reported.
+"""
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+from lxml import etree
+
+from libs.pascal_voc_io import XML_EXT, ENCODE_METHOD
+from libs.pascal_voc_io import decodeContour, encodeContour, writeTree
+
+
+def findAnnotations(folders):
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            for file in files:
+                if file.lower().endswith(XML_EXT):
+                    yield os.path.join(root, file)
+
+
+def migrateFile(xmlPath):
+    """Return the number of converted contours of one annotation file and
+    the number of contours that were left as they are because their text
+    cannot be parsed. Files whose root is not <annotation> are skipped."""
+    parser = etree.XMLParser(encoding=ENCODE_METHOD)
+    tree = etree.parse(xmlPath, parser=parser)
+    root = tree.getroot()
+    if root.tag != 'annotation':
+        return 0, 0
+    converted, unreadable = 0, 0
+    for contour in root.iter('contour'):
+        if contour.get('encoding') is not None:
+            continue
+        try:
+            contour_points = decodeContour(contour.text)
+        except Exception:
+            # the original text is kept for a manual repair
+            unreadable += 1
+            continue
+        encoding, text = encodeContour(contour_points)
+        contour.text = text or None
+        contour.set('encoding', encoding)
+        converted += 1
+    if converted:
+        writeTree(root, xmlPath)
+    return converted, unreadable
+
+
+def _migrate(xmlPath):
+    try:
+        return (xmlPath,) + migrateFile(xmlPath) + (None,)
+    except Exception as e:
+        return xmlPath, 0, 0, e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Konturen vorhandener Annotationen kompakt speichern')
+    parser.add_argument('folders', nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Anzahl paralleler Prozesse')
+    args = parser.parse_args(argv)
+
+    files, contours, failed, unreadableContours = 0, 0, 0, 0
+    with Pool(args.jobs) as pool:
+        for xmlPath, converted, unreadable, error in pool.imap_unordered(_migrate, findAnnotations(args.folders), chunksize=16):
+            if error is not None:
+                failed += 1
+                print('Fehler in {0}: {1}'.format(xmlPath, error), file=sys.stderr)
+                continue
+            if unreadable:
+                unreadableContours += unreadable
+                print('{0} nicht lesbare Konturen in {1} unverändert gelassen'.format(unreadable, xmlPath), file=sys.stderr)
+            if converted:
+                files += 1
+                contours += converted
+    print('{0} Konturen in {1} Dateien konvertiert, {2} Fehler, {3} nicht lesbare Konturen'.format(contours, files, failed, unreadableContours))
+    return 1 if failed or unreadableContours else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
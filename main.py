@@ -5,8 +5,8 @@ import os
 import os.path
 import platform
 import logging
+import sqlite3
 import sys
-import glob
 from functools import partial
 from PIL import Image, ImageFont, ImageDraw
 import numpy as np
@@ -40,6 +40,13 @@ from libs.constants import *
 from libs.labelDialog import LabelDialog
 from libs.labelFile import LabelFile
 from libs.labelFile import LabelFileError
+from libs.editJournal import EditJournal, waitForCompactions
+from libs.undoHistory import UndoHistory, UNDO_MEMORY_BYTES
+from libs.prefetch import ImagePrefetcher, loadImage, PREFETCH_CACHE_BYTES
+from libs.imageBuffer import ImageBuffer
+from libs.annotationIndex import AnnotationIndex
+from libs.fileListModel import FileListModel
+from libs.dirScanner import DirScanner
 from libs.lib import addActions
 from libs.lib import generateColorByText
 from libs.lib import newAction
@@ -58,6 +65,10 @@ from libs.detection import OBJ_THRESH
 from libs.detection import MaskRCNNDetector
 from libs.detection import UNetSegmentation
 from libs.excelExport import cellTableGenerator, scaleDialog
+from libs.cocoExport import CocoExporter
+from libs.catalog import ProjectCatalog
+from libs.maskSidecar import readSidecar, writeSidecar, removeSidecar, maskPixels, buildContourPoints
+from libs.measurement import LabelMap, absoluteContour, labelIntensityStats, labelMorphometry
 
 __appname__ = 'ADPKD Support Tool'
 
@@ -124,6 +135,10 @@ class MainWindow(QMainWindow, WindowMixin):
         # For loading all image under a directory
         self.mImgList = []
         self.dirname = None
+        # database of all shapes and measurements of the opened folder
+        self.catalog = None
+        # running COCO export, see exportCoco
+        self.cocoExporter = None
         self.labelHist = []
         self.lastOpenDir = None
 
@@ -169,8 +184,23 @@ class MainWindow(QMainWindow, WindowMixin):
         listLayout.addWidget(useDefaultLabelContainer)
 
         
-        self.fileListWidget = QListWidget()
-        self.fileListWidget.itemDoubleClicked.connect(self.fileitemDoubleClicked)
+        self.annotationIndex = AnnotationIndex(self.labelsPath, self)
+        self.fileListModel = FileListModel(self.annotationIndex, self)
+        self.dirScanner = DirScanner(self)
+        self.dirScanner.found.connect(self.scanFound)
+        self.dirScanner.finished.connect(self.scanFinished)
+        # a table view lays out rows lazily, a tree view walks all of them
+        self.fileListWidget = QTableView()
+        self.fileListWidget.setModel(self.fileListModel)
+        self.fileListWidget.setShowGrid(False)
+        self.fileListWidget.setWordWrap(False)
+        self.fileListWidget.verticalHeader().hide()
+        self.fileListWidget.verticalHeader().setDefaultSectionSize(self.fileListWidget.fontMetrics().height() + 4)
+        self.fileListWidget.horizontalHeader().setStretchLastSection(True)
+        self.fileListWidget.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.fileListWidget.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.fileListWidget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.fileListWidget.doubleClicked.connect(self.fileitemDoubleClicked)
         filelistLayout = QVBoxLayout()
         filelistLayout.setContentsMargins(0, 0, 0, 0)
         filelistLayout.addWidget(self.fileListWidget)
@@ -195,11 +225,28 @@ class MainWindow(QMainWindow, WindowMixin):
         }
         self.scrollArea = scroll
         self.canvas.scrollRequest.connect(self.scrollRequest)
-
-        self.canvas.saveFileSignal.connect(self.saveFile)
+        for bar in self.scrollBars.values():
+            # panning with the scroll bars draws with fast render hints
+            bar.valueChanged.connect(lambda value: self.canvas.beginInteraction(navigate=True))
+
+        self.canvas.saveFileSignal.connect(self.contourEdited)
+
+        # Edits are logged to a journal and merged into the annotation file
+        # once the user paused for a moment.
+        self.journal = None
+        self.compactTimer = QTimer(self)
+        self.compactTimer.setSingleShot(True)
+        self.compactTimer.setInterval(2000)
+        self.compactTimer.timeout.connect(self.compactJournal)
+        # undo steps of the current image, the memory they may take can be
+        # set in the settings
+        self.history = UndoHistory(settings.get(SETTING_UNDO_MEMORY, UNDO_MEMORY_BYTES))
+        self.canvas.editFinished.connect(self.recordUndo)
+        # images next to the current one are decoded ahead of navigation
+        self.prefetcher = ImagePrefetcher(self.labelsPath, maxBytes=settings.get(SETTING_PREFETCH_MEMORY, PREFETCH_CACHE_BYTES))
 
         self.canvas.newShape.connect(self.newShape)
-        self.canvas.shapeMoved.connect(self.setDirty)
+        self.canvas.shapeMoved.connect(self.shapeMoved)
         self.canvas.selectionChanged.connect(self.shapeSelectionChanged)
         self.canvas.drawingPolygon.connect(self.toggleDrawingSensitive)
 
@@ -229,11 +276,16 @@ class MainWindow(QMainWindow, WindowMixin):
         createMode = action('&Markierung\nerstellen', self.setCreateMode, 'w', 'icons/feBlend-icon.png', u'Markierungsmodus', enabled=False)
         editMode = action('&Markierungen\nbearbeiten', self.setEditMode, 'Ctrl+J', 'icons/edit.png', u'Editierungsmodus', enabled=False)
         delete = action('&Markierungen\nlöschen', self.deleteSelectedShape, 'delete', 'icons/delete.png', u'Löschen', enabled=False)
+        undo = action('&Rückgängig', self.undoEdit, 'Ctrl+Z', 'icons/undo.png', u'Letzte Änderung rückgängig machen', enabled=False)
+        redo = action('&Wiederherstellen', self.redoEdit, 'Ctrl+Y', 'icons/undo-cross.png', u'Rückgängig gemachte Änderung wiederherstellen', enabled=False)
         reload = action('&Bild neu laden', self.reloadImg, 'Ctrl+R', 'icons/verify.png', u'Aktuelle Bild neu laden', enabled=True)
         resetBoxes = action('&Markierungen\nzurücksetzen', self.resetImg, None, 'icons/quit.png', u'Markierungen des aktuellen Bildes zurücksetzen', enabled=True)
         contourOverlay = action('Konturmodus', self.toggleContourOverlay, 'Ctrl+Shift+C', 'Overlay einblenden', u'Kontur einblenden', checkable=True, enabled=True)
         unet_usage = action('UNet verwenden', self.toggleUnet, None, 'UNet zum Segmentieren verwenden', u'UNet verwenden', checkable=True, enabled=True, checked=True)
+        maskSidecar = action('Masken speichern', self.toggleMaskSidecar, None, None, u'Masken der Erkennung in voller Auflösung speichern', checkable=True, enabled=True, checked=False)
+        catalog = action('Projektkatalog führen', self.toggleCatalog, None, None, u'Zellen und Messungen des Ordners in catalog.sqlite speichern', checkable=True, enabled=True, checked=False)
         generateOutput = action('Ergebnis\n erzeugen', self.genOutput, None, 'icons/labels.png', u'Ergebnisbild erzeugen')
+        exportCoco = action('COCO\nexportieren', self.exportCoco, None, 'icons/save-as.png', u'Annotationen des Ordners als COCO JSON exportieren')
         autoDetect = action('&Automatische\nErkennung', self.cellDetection, None, 'icons/zoom.png', u'Automatische Erkennung von Zellen')
         autoDetectDir = action('&Automatische\nErkennung\n des Ordners', self.cellDetectionDir, None, 'icons/zoom.png', u'Automatische Erkennung von Zellen des gesamten Ordners')
         zoomIn = action('Zoom &In', partial(self.addZoom, 10), 'Ctrl++', 'zoom-in', u'Increase zoom level', enabled=False)
@@ -256,6 +308,7 @@ class MainWindow(QMainWindow, WindowMixin):
         self.actions = struct(save=save,
         close=close, resetSettings=resetSettings,
         delete=delete,
+        undo=undo, redo=redo,
         createMode=createMode, editMode=editMode,
         autoDetect=autoDetect,
         autoDetectDir=autoDetectDir,
@@ -263,21 +316,29 @@ class MainWindow(QMainWindow, WindowMixin):
         generateOutput=generateOutput,
         # segmentationOverlay=segmentationOverlay,
         contourOverlay=contourOverlay,
+        maskSidecar=maskSidecar,
+        catalog=catalog,
         advancedContext=(delete, contourOverlay),
         onLoadActive=(close, createMode, editMode))
 
         self.menus = struct(
+            edit=self.menu('&Bearbeiten'),
             overlays=self.menu('&Konturen'))
 
-        addActions(self.menus.overlays, (contourOverlay, unet_usage))
+        addActions(self.menus.edit, (undo, redo))
+        addActions(self.menus.overlays, (contourOverlay, unet_usage, maskSidecar, catalog))
         addActions(self.canvas.menus[0], self.actions.advancedContext)
         # addActions(self.canvas.menus[1], [action('&Move here', self.moveShape)])
         self.tools = self.toolbar('Tools')
 
-        self.actions.advanced = (opendir, openNextImg, openPrevImg, createMode, autoDetectDir, autoDetect, save, reload, None, editMode, delete, generateOutput, None,  resetBoxes, resetSettings)
+        self.actions.advanced = (opendir, openNextImg, openPrevImg, createMode, autoDetectDir, autoDetect, save, reload, None, editMode, delete, generateOutput, exportCoco, None,  resetBoxes, resetSettings)
 
         # Application state.
         self.image = QImage()
+        # pixels of the opened image, shared by canvas, detection and
+        # measurements
+        self.imageBuffer = None
+        self.imageShape = None
         self.filePath = ustr(defaultFilename)
         self.recentFiles = []
         # self.maxRecent = 7
@@ -321,6 +382,11 @@ class MainWindow(QMainWindow, WindowMixin):
         if xbool(settings.get(SETTING_ADVANCE_MODE, False)):
             pass
 
+        self.maskSidecar = xbool(settings.get(SETTING_MASK_SIDECAR, False))
+        self.actions.maskSidecar.setChecked(self.maskSidecar)
+        self.catalogEnabled = xbool(settings.get(SETTING_CATALOG, False))
+        self.actions.catalog.setChecked(self.catalogEnabled)
+
         # Since loading the file may take some time, make sure it runs in the background.
         if self.filePath and os.path.isdir(self.filePath):
             self.queueEvent(partial(self.importDirImages, self.filePath or ""))
@@ -332,6 +398,8 @@ class MainWindow(QMainWindow, WindowMixin):
         self.populateModeActions()
         self.labelCoordinates = QLabel('')
         self.statusBar().addPermanentWidget(self.labelCoordinates)
+        self.labelMemory = QLabel('')
+        self.statusBar().addPermanentWidget(self.labelMemory)
         # Open Dir if deafult file
         if self.filePath and os.path.isdir(self.filePath):
             pass
@@ -381,9 +449,14 @@ class MainWindow(QMainWindow, WindowMixin):
         #self.labelList.clear()
         self.filePath = None
         self.imageData = None
+        self.imageShape = None
+        self.imageBuffer = None
         self.labelFile = None
         self.canvas.resetState()
+        self.history.reset([])
+        self.updateUndoActions()
         self.labelCoordinates.clear()
+        self.showImageMemory()
 
     def currentItem(self):
         if items:
@@ -442,10 +515,19 @@ class MainWindow(QMainWindow, WindowMixin):
     def toggleUnet(self, show=True):
         self.unet_usage = show
 
-    def fileitemDoubleClicked(self, item=None):
-        currIndex = self.mImgList.index(ustr(item.text()))
-        if currIndex < len(self.mImgList):
-            filename = self.mImgList[currIndex]
+    def toggleMaskSidecar(self, enabled=False):
+        self.maskSidecar = enabled
+
+    def toggleCatalog(self, enabled=False):
+        self.catalogEnabled = enabled
+        if not enabled:
+            self.closeCatalog()
+        elif self.catalog is None and self.dirname is not None:
+            self.openCatalog(self.dirname)
+
+    def fileitemDoubleClicked(self, index=None):
+        if index is not None and index.isValid():
+            filename = self.fileListModel.path(index.row())
             if filename:
                 self.loadFile(filename)
 
@@ -489,15 +571,14 @@ class MainWindow(QMainWindow, WindowMixin):
 
     def loadLabels(self, shapes):
         s = []
-        for label, points, line_color, fill_color, contour_points, confidence, contourEdited in shapes:
+        for label, points, line_color, fill_color, contour_points, confidence, contourEdited, maskLabel in shapes:
             shape = Shape(label=label)
             for x, y in points:
                 shape.addPoint(QPointF(x, y))
-            if contour_points:
-                for x, y in contour_points:
-                    shape.addContourPoint((x, y))
+            shape.contour_points = contour_points
             shape.confidence = confidence
             shape.contourEdited = contourEdited
+            shape.maskLabel = maskLabel
             shape.close()
             s.append(shape)
             if line_color:
@@ -510,34 +591,167 @@ class MainWindow(QMainWindow, WindowMixin):
                 shape.fill_color = generateColorByText(label)
             self.addLabel(shape)
         self.canvas.loadShapes(s)
-
-    def saveLabels(self, annotationFilePath):
-        annotationFilePath = ustr(annotationFilePath)
+        self.history.reset(self.canvas.shapes)
+        self.updateUndoActions()
+
+    def formatShape(self, s):
+        return dict(label=s.label,
+                    line_color=s.line_color.getRgb(),
+                    fill_color=s.fill_color.getRgb(),
+                    points=[(p.x(), p.y()) for p in s.points],
+                    contour_points=s.contour_points.copy(),
+                    confidence=s.confidence,
+                    contourEdited=s.contourEdited,
+                    maskLabel=s.maskLabel)
+
+    def annotationWriter(self, annotationFilePath):
+        """Return a callable storing a snapshot of the current shapes, it
+        does not touch any widget and may run in the background."""
         if self.labelFile is None:
             self.labelFile = LabelFile()
             self.labelFile.verified = self.canvas.verified
+        shapes = [self.formatShape(shape) for shape in self.canvas.shapes]
+        if self.usingPascalVocFormat is not True:
+            return partial(self.labelFile.save, annotationFilePath, shapes, self.filePath, self.imageData, self.lineColor.getRgb(), self.fillColor.getRgb())
+        save = partial(self.labelFile.savePascalVocFormat, annotationFilePath, shapes, self.filePath, self.imageData, self.lineColor.getRgb(), self.fillColor.getRgb(), imageShape=self.imageShape)
+        catalog, imagePath, imageShape, verified = self.catalog, self.filePath, self.imageShape, self.labelFile.verified
+
+        def write():
+            save()
+            self.updateCatalog(catalog, 'updateImage', imagePath, shapes, imageShape, verified)
+        return write
+
+    def updateCatalog(self, catalog, method, *args):
+        """Call a ProjectCatalog method, failures are only logged so that
+        they never stop a save."""
+        if catalog is None:
+            return
+        try:
+            getattr(catalog, method)(*args)
+        except (sqlite3.Error, OSError) as e:
+            logging.error('Updating the catalog {0} failed: {1}'.format(catalog.path, e))
 
-        def format_shape(s):
-            return dict(label=s.label,
-                        line_color=s.line_color.getRgb(),
-                        fill_color=s.fill_color.getRgb(),
-                        points=[(p.x(), p.y()) for p in s.points],
-                        contour_points=s.contour_points,
-                        confidence=s.confidence,
-                        contourEdited=s.contourEdited)
-
-        shapes = [format_shape(shape) for shape in self.canvas.shapes]
+    def saveLabels(self, annotationFilePath):
+        annotationFilePath = ustr(annotationFilePath)
+        write = self.annotationWriter(annotationFilePath)
         try:
-            if self.usingPascalVocFormat is True:
-                logging.info('Img: ' + self.filePath + ' -> Its xml: ' + annotationFilePath)
-                self.labelFile.savePascalVocFormat(annotationFilePath, shapes, self.filePath, self.imageData, self.lineColor.getRgb(), self.fillColor.getRgb())
+            logging.info('Img: ' + self.filePath + ' -> Its xml: ' + annotationFilePath)
+            if self.journal is not None and self.journal.annotationPath == annotationFilePath:
+                # a full save covers everything logged so far
+                self.compactTimer.stop()
+                self.journal.compact(write, wait=True)
             else:
-                self.labelFile.save(annotationFilePath, shapes, self.filePath, self.imageData, self.lineColor.getRgb(), self.fillColor.getRgb())
+                write()
             return True
         except LabelFileError as e:
             self.errorMessage(u'Error saving label data', u'<b>%s</b>' % e)
             return False
 
+    def recordEdit(self, changed=(), deletedIndex=None, full=False):
+        """Log edited shapes, given as (index, shape), or a deleted index to
+        the journal instead of rewriting the annotation file. With full=True
+        the whole state is logged."""
+        if self.journal is None:
+            # nothing to log to, the changes wait for the next save
+            self.setDirty()
+            return
+        if self.dirty or full:
+            # earlier changes were never logged, start from the full state
+            self.journal.reset([self.formatShape(s) for s in self.canvas.shapes])
+        else:
+            if deletedIndex is not None:
+                self.journal.delete(deletedIndex)
+            for index, shape in changed:
+                self.journal.put(index, self.formatShape(shape))
+        self.setClean()
+        self.compactTimer.start()
+
+    def journalChanges(self, changes):
+        """Log the changes of an undo step, as (shape, index, before,
+        after), to the journal."""
+        deleted = [index for shape, index, before, after in changes if after is None]
+        changed = sorted((index, shape) for shape, index, before, after in changes if after is not None)
+        created = [index for shape, index, before, after in changes if before is None]
+        if len(deleted) == 1 and not created:
+            self.recordEdit(changed, deletedIndex=deleted[0])
+        elif not deleted and all(index >= len(self.canvas.shapes) - len(created) for index in created):
+            # new shapes are appended in order by the put records
+            self.recordEdit(changed)
+        else:
+            self.recordEdit(full=True)
+
+    def shapeMoved(self):
+        # the move is logged when the drag ends
+        if self.journal is None:
+            self.setDirty()
+
+    def contourEdited(self, shape):
+        self.recordUndo()
+
+    def recordUndo(self, merge=False):
+        """Store the edits since the last call as undo step and log them to
+        the journal, every edit of the shapes ends up here."""
+        changes = self.history.record(self.canvas.shapes, merge)
+        self.updateUndoActions()
+        if changes:
+            self.journalChanges(changes)
+
+    def updateUndoActions(self):
+        self.actions.undo.setEnabled(self.history.canUndo())
+        self.actions.redo.setEnabled(self.history.canRedo())
+
+    def undoEdit(self):
+        self.restoreEdit(self.history.undo)
+
+    def redoEdit(self):
+        self.restoreEdit(self.history.redo)
+
+    def restoreEdit(self, step):
+        if self.canvas.drawing() and self.canvas.current:
+            return
+        # edits not recorded yet become a step of their own first
+        self.recordUndo()
+        changes = step(self.canvas.shapes)
+        if changes is None:
+            return
+        restructured = False
+        for shape, index, before, after in changes:
+            if before is None or after is None:
+                restructured = True
+                if shape in self.canvas.shapes and shape not in self.shapesToItems:
+                    self.addLabel(shape)
+                elif shape not in self.canvas.shapes and shape in self.shapesToItems:
+                    self.remLabel(shape)
+        self.canvas.shapesRestored()
+        self.recordEdit([(index, shape) for shape, index, before, after in changes], full=restructured)
+        self.updateUndoActions()
+
+    def compactJournal(self, wait=False):
+        if self.journal is None or not self.journal.hasRecords() or self.filePath is None:
+            return
+        self.compactTimer.stop()
+        self.journal.compact(self.annotationWriter(self.journal.annotationPath), wait)
+
+    def discardJournal(self, imagePath):
+        """Drop the journal of an image whose annotation file is replaced, its
+        records refer to shapes by their index in the old file."""
+        annotationPath = self.annotationPath(imagePath)
+        if self.journal is not None and self.journal.annotationPath == annotationPath:
+            self.journal.discard()
+        else:
+            EditJournal(annotationPath).discard()
+
+    def recoverJournal(self):
+        """Apply edits a crash left in the journal and store them."""
+        shapes = self.journal.replay([self.formatShape(s) for s in self.canvas.shapes])
+        if shapes is None:
+            return
+        logging.info('Recovering edits from ' + self.journal.path)
+        self.itemsToShapes.clear()
+        self.shapesToItems.clear()
+        self.loadLabels([(d['label'], d['points'], d['line_color'], d['fill_color'], d['contour_points'], d['confidence'], d['contourEdited'], d.get('maskLabel')) for d in shapes])
+        self.compactJournal(wait=True)
+
     def labelSelectionChanged(self):
         item = self.currentItem()
         if item and self.canvas.editing():
@@ -551,7 +765,8 @@ class MainWindow(QMainWindow, WindowMixin):
         if label != shape.label:
             shape.label = item.text()
             shape.line_color = generateColorByText(shape.label)
-            self.setDirty()
+            self.canvas.invalidateLayer()
+            self.recordUndo()
         else:
             self.canvas.setShapeVisible(shape, item.checkState() == Qt.Checked)
 
@@ -566,7 +781,7 @@ class MainWindow(QMainWindow, WindowMixin):
             self.addLabel(shape)
             self.actions.editMode.setEnabled(True)
             self.actions.delete.setEnabled(False)
-            self.setDirty()
+            self.recordUndo()
         else:
             self.canvas.resetAllLines()
 
@@ -631,21 +846,20 @@ class MainWindow(QMainWindow, WindowMixin):
             item.setCheckState(Qt.Checked if value else Qt.Unchecked)
 
     def loadFile(self, filePath=None, overlays=None):
+        self.compactJournal(wait=True)
+        self.journal = None
         self.resetState()
         self.canvas.setEnabled(False)
         if filePath is None:
             filePath = self.settings.get(SETTING_FILENAME)
         filePath = str(filePath)
         unicodeFilePath = ustr(filePath)
-        if unicodeFilePath and self.fileListWidget.count() > 0:
-            index = self.mImgList.index(unicodeFilePath)
-            fileWidgetItem = self.fileListWidget.item(index)
-            fileWidgetItem.setSelected(True)
+        self.selectFileItem(unicodeFilePath)
         if unicodeFilePath and os.path.exists(unicodeFilePath):
-            img = read(unicodeFilePath, None)
-            height, width, channel = img.shape
-            bytesPerLine = 3 * width
-            image = QImage(img.data, width, height, bytesPerLine, QImage.Format_RGB888)
+            loaded = self.prefetcher.take(unicodeFilePath)
+            if loaded is None:
+                loaded = loadImage(unicodeFilePath, self.labelsPath(unicodeFilePath))
+            image = loaded.buffer.image if loaded.buffer is not None else QImage()
             self.labelFile = None
             if image.isNull():
                 self.errorMessage(u'Fehler beim Öffnen des Bildes', u"<p>Sicherstellen, dass <i>%s</i> ein zulässiges Format hat." % unicodeFilePath)
@@ -653,8 +867,11 @@ class MainWindow(QMainWindow, WindowMixin):
                 return False
             self.status("Loaded %s" % os.path.basename(unicodeFilePath))
             self.image = image
+            self.imageBuffer = loaded.buffer
+            self.imageShape = loaded.buffer.shape
             self.filePath = unicodeFilePath
-            self.canvas.loadPixmap(QPixmap.fromImage(image))
+            self.canvas.loadPixmap(image, owner=loaded.buffer)
+            self.showImageMemory()
             if self.labelFile:
                 self.loadLabels(self.labelFile.shapes)
             self.setClean()
@@ -662,20 +879,48 @@ class MainWindow(QMainWindow, WindowMixin):
             self.adjustScale(initial=True)
             self.paintCanvas()
             self.toggleActions(True)
-            if self.usingPascalVocFormat is True:
-                if self.defaultSaveDir is not None:
-                    basename = os.path.basename(os.path.splitext(self.filePath)[0]) + XML_EXT
-                    xmlPath = os.path.join(self.defaultSaveDir, basename)
-                    self.loadPascalXMLByFilename(xmlPath)
-                else:
-                    xmlPath = os.path.splitext(filePath)[0] + XML_EXT
-                    if os.path.isfile(xmlPath):
-                        self.loadPascalXMLByFilename(xmlPath)
+            if self.usingPascalVocFormat is True and loaded.shapes is not None:
+                self.loadLabels(loaded.shapes)
+                self.canvas.verified = loaded.verified
+            self.journal = EditJournal(self.annotationPath(self.filePath))
+            self.recoverJournal()
             self.setWindowTitle(__appname__ + ' ' + filePath)
             self.canvas.setFocus(True)
+            self.prefetchNeighbours()
             return True
         return False
 
+    def showImageMemory(self):
+        if self.imageBuffer is None:
+            self.labelMemory.clear()
+            return
+        self.labelMemory.setText(u'Bildspeicher: %.1f MB' % (self.imageBuffer.nbytes() / 1024.0 ** 2))
+
+    def currentImage(self, imagePath):
+        """ImageBuffer of an image, the one of the opened image is shared."""
+        if self.imageBuffer is not None and self.imageBuffer.path == imagePath:
+            return self.imageBuffer
+        return ImageBuffer.read(imagePath)
+
+    def labelsPath(self, imagePath):
+        """Annotation file loaded for an image."""
+        if self.defaultSaveDir is not None:
+            return os.path.join(self.defaultSaveDir, os.path.basename(os.path.splitext(imagePath)[0]) + XML_EXT)
+        return os.path.splitext(imagePath)[0] + XML_EXT
+
+    def prefetchNeighbours(self, count=2):
+        """Load the next and previous images in the background, the next
+        ones first as the list is usually stepped forward."""
+        index = self.fileListModel.row(self.filePath)
+        if index is None:
+            return
+        paths = []
+        for step in range(1, count + 1):
+            for i in (index + step, index - step):
+                if 0 <= i < len(self.mImgList):
+                    paths.append(self.mImgList[i])
+        self.prefetcher.prefetch(paths)
+
     def resizeEvent(self, event):
         if self.canvas and not self.image.isNull()\
            and self.zoomMode != self.MANUAL_ZOOM:
@@ -711,6 +956,7 @@ class MainWindow(QMainWindow, WindowMixin):
     def closeEvent(self, event):
         if self.dirty:
             self.saveFile()
+        self.compactJournal(wait=True)
         settings = self.settings
         # If it loads images from dir, don't load it at the begining
         if self.dirname is None:
@@ -725,6 +971,10 @@ class MainWindow(QMainWindow, WindowMixin):
         settings[SETTING_RECENT_FILES] = self.recentFiles
         settings[SETTING_PIXEL_SCALING] = self.pixel_scale
         settings[SETTING_UNET_USAGE] = self.unet_usage
+        settings[SETTING_MASK_SIDECAR] = self.maskSidecar
+        settings[SETTING_CATALOG] = self.catalogEnabled
+        settings[SETTING_UNDO_MEMORY] = self.history.maxBytes
+        settings[SETTING_PREFETCH_MEMORY] = self.prefetcher.maxBytes
         if self.defaultSaveDir and os.path.exists(self.defaultSaveDir):
             settings[SETTING_SAVE_DIR] = ustr(self.defaultSaveDir)
         else:
@@ -751,7 +1001,11 @@ class MainWindow(QMainWindow, WindowMixin):
                 return
         if not self.deleteAnnotationsDialog():
             return
+        if self.journal is not None:
+            self.journal.discard()
         os.remove(anno_file)
+        removeSidecar(self.filePath)
+        self.updateCatalog(self.catalog, 'removeImage', self.filePath)
         logging.info('Reset image')
         self.reloadImg()
 
@@ -762,9 +1016,9 @@ class MainWindow(QMainWindow, WindowMixin):
         currentPath = self.filePath
         localPath = self.filePath.split(os.path.basename(currentPath))[0]
         imgFileName = os.path.basename(currentPath)
-        currentImg = io.imread(currentPath)
+        currentImg = self.currentImage(currentPath)
         if isinstance(self.detector, MaskRCNNDetector):
-            boxes = self.detector.predictBoxesAndContour(currentImg)
+            boxes, labels = self.detector.predictBoxesAndContour(currentImg.rgb8(), returnLabels=True)
             height, width, depth = currentImg.shape
             filename = currentPath.split('.')[0] + '.xml'
             writer = PascalVocWriter('{0}'.format(localPath), imgFileName, [height, width, depth], localImgPath=currentPath)
@@ -776,11 +1030,22 @@ class MainWindow(QMainWindow, WindowMixin):
                 ymax = box.ymax
                 contour = box.contour
                 confidence = box.confidence
-                writer.addBndBox(xmin, ymin, xmax, ymax, 'cell', contour, confidence, False)
+                maskLabel = box.maskLabel if self.maskSidecar else None
+                writer.addBndBox(xmin, ymin, xmax, ymax, 'cell', contour, confidence, False, maskLabel)
+            if self.maskSidecar:
+                writeSidecar(currentPath, labels)
+            else:
+                # an older sidecar would not match the new detection
+                removeSidecar(currentPath)
+        # the detection replaces all edits of this image, also those left by
+        # a crash while another image is open
+        self.discardJournal(currentPath)
         writer.save(targetFile=filename)
+        self.updateCatalog(self.catalog, 'updateFromAnnotation', currentPath)
         self.loadRecent(currentPath, True)
 
     def cellDetectionDir(self):
+        self.waitForScan()
         progress = QProgressDialog('Erkenne Zellen {0}/{1}'.format(0, len(self.mImgList)), None, 0, 0, self)
         progress.setWindowTitle('Bitte warten')
         progress.setWindowModality(Qt.WindowModal)
@@ -797,20 +1062,25 @@ class MainWindow(QMainWindow, WindowMixin):
         progress = QMessageBox.information(self, u'Information', 'Erkennnung der Zellen abgeschlossen')
 
     def calcContours(self):
-        rendered = False
+        changed = list()
         if not self.canvas.shapes:
             return
         else:
-            fullImg = io.imread(self.filePath)
+            fullImg = self.currentImage(self.filePath).rgb8()
+            labels = readSidecar(self.filePath) if any(s.maskLabel is not None for s in self.canvas.shapes) else None
             for i, s in enumerate(self.canvas.shapes):
                 xmin, ymin = int(s.points[0].x()), int(s.points[0].y())
                 xmax, ymax = int(s.points[2].x()), int(s.points[2].y())
                 img = fullImg[ymin:ymax + 1, xmin:xmax + 1, :]
 
-                if self.canvas.shapes[i].contour_points:
+                if len(self.canvas.shapes[i].contour_points):
                     continue
+                elif labels is not None and s.maskLabel is not None:
+                    # re-contour from the stored detection mask, no model needed
+                    points = buildContourPoints(labels[ymin:ymax, xmin:xmax] == s.maskLabel)
+                    s.contour_points = points if len(points) >= 5 else list()
+                    changed.append((i, s))
                 else:
-                    rendered = True
                     img = rgb2gray(img)
                     try:
                         assert_nD(img, 2)
@@ -854,16 +1124,19 @@ class MainWindow(QMainWindow, WindowMixin):
                         self.canvas.shapes[i].contour_points = list()
                     else:
                         self.canvas.shapes[i].contour_points = points.copy()
-        if rendered:
-            self.saveFile()
+                    changed.append((i, self.canvas.shapes[i]))
+        if changed:
+            self.recordUndo()
 
     def genOutput(self):
         if self.dirname is None: 
             return
-        number_anno_files = len(glob.glob(self.dirname + '/' + '*.xml'))
-        currentImg = io.imread(self.filePath)
-        width, height = currentImg.shape[0], currentImg.shape[1]
-        del(currentImg)
+        self.waitForScan()
+        self.annotationIndex.wait()
+        # the progress maximum and the loop use the same images
+        annotated = set(p for p in self.mImgList if self.annotationIndex.get(p) is not None)
+        number_anno_files = len(annotated)
+        width, height = self.imageShape[0], self.imageShape[1]
         dialog = scaleDialog(parent=self, width=width, height=height, scaling=self.pixel_scale)
         dialog.exec()
         self.pixel_scale = dialog.pixel_scale
@@ -879,8 +1152,7 @@ class MainWindow(QMainWindow, WindowMixin):
         progress.forceShow()
         for p in self.mImgList:
             marked_img_list = list()
-            anno_file = p.split('.')[0] + '.xml'
-            if not os.path.exists(anno_file):
+            if p not in annotated:
                 continue
             else:
                 progress.setLabelText('Erzeuge Ergebnisse {0}/{1}'.format(progress.value() + 1, number_anno_files))
@@ -892,9 +1164,21 @@ class MainWindow(QMainWindow, WindowMixin):
                 font = ImageFont.truetype('UbuntuMono.ttf', 30)
                 image_filename = self.filePath.split('/')[-1]
                 tableGenerator.add_cellcount(image_filename, len(self.canvas.shapes))
+                measurements = dict()
+                contours = [absoluteContour(s.points[0].x(), s.points[0].y(), s.contour_points) for s in self.canvas.shapes]
+                regions = dict()
+                masks = readSidecar(self.filePath) if any(s.maskLabel is not None for s in self.canvas.shapes) else None
+                if masks is not None and masks.shape == (draw_file.height, draw_file.width):
+                    for i, s in enumerate(self.canvas.shapes):
+                        if s.maskLabel is not None and not s.contourEdited:
+                            regions[i] = maskPixels(masks, s.maskLabel, int(s.points[0].x()), int(s.points[0].y()), int(s.points[2].x()), int(s.points[2].y()))
+                labelMap = LabelMap(contours, (draw_file.height, draw_file.width), regions)
+                exclusiveArea, labelPerim = labelMorphometry(labelMap)
+                # intensities in the original value range, e.g. 16 bit
+                meanIntensity, medianIntensity, stdIntensity = labelIntensityStats(labelMap, self.imageBuffer.array)
                 for i, s in enumerate(self.canvas.shapes):
                     xmin, xmax, ymin, ymax = s.points[0].x(), s.points[2].x(), s.points[0].y(), s.points[2].y()
-                    if not s.contour_points:
+                    if not len(s.contour_points):
                         continue
                     else:
                         polygon_points = [(int(x+xmin), int(y+ymin)) for y, x in s.contour_points]
@@ -902,11 +1186,22 @@ class MainWindow(QMainWindow, WindowMixin):
                         perimeter = polygon.length * self.pixel_scale  # polygon.length is defined as perimeter of polygon shape
                         r = perimeter / (2 * np.pi)  
                         V = (4/3) * np.pi * (r**3)
-                        tableGenerator.add_cell(i+1, image_filename, polygon.area * (self.pixel_scale**2), perimeter, r, V)
+                        m = dict(area=polygon.area * (self.pixel_scale**2), perimeter=perimeter, radius=r, volume=V,
+                                 label_area=float(labelMap.rawArea[i+1] * (self.pixel_scale**2)),
+                                 exclusive_area=float(exclusiveArea[i+1] * (self.pixel_scale**2)),
+                                 label_perimeter=float(labelPerim[i+1] * self.pixel_scale),
+                                 intensity_mean=float(meanIntensity[i+1]), intensity_median=float(medianIntensity[i+1]),
+                                 intensity_std=float(stdIntensity[i+1]))
+                        measurements[i+1] = m
+                        tableGenerator.add_cell(i+1, image_filename, m['area'], m['perimeter'], m['radius'], m['volume'],
+                                                m['label_area'], m['exclusive_area'], m['label_perimeter'],
+                                                m['intensity_mean'], m['intensity_median'], m['intensity_std'])
                         draw.text((int(xmax - ((xmax - xmin)//2)), int(ymax - ((ymax - ymin)//2))), "{:.3f}".format(polygon.area * (self.pixel_scale**2)), fill=(0,0,0,255), font=font)
                         draw.text((int(xmin), int(ymin)), "{}".format(i+1), fill=(0,0,0,255), font=font)
                         draw.polygon(polygon_points, outline=(255,255,0,255))
                 draw.text((10, 10), str(len(self.canvas.shapes)), fill=(0,0,0,255), font=font)
+                self.updateCatalog(self.catalog, 'updateImage', self.filePath, [self.formatShape(s) for s in self.canvas.shapes], self.imageShape)
+                self.updateCatalog(self.catalog, 'setMeasurements', self.filePath, measurements, self.pixel_scale)
                 draw_file.save(self.filePath.split('.')[0] + '_done' + '.jpg')
                 progress.setValue(progress.value() + 1)
         progress.close()
@@ -914,23 +1209,96 @@ class MainWindow(QMainWindow, WindowMixin):
         info = QMessageBox.information(self, u'Information', 'Ergebnis wurde in {0}.xlsx gespeichert'.format(excel_filename))
 
 
+    def exportCoco(self):
+        if self.dirname is None:
+            return
+        if self.dirty:
+            self.saveFile()
+        self.compactJournal(wait=True)
+        filename = QFileDialog.getSaveFileName(self, '%s - COCO Export' % __appname__, os.path.join(self.dirname, 'annotations.json'), 'COCO JSON (*.json)')
+        if isinstance(filename, (tuple, list)):
+            filename = filename[0]
+        if not filename:
+            return
+        mode, ok = QInputDialog.getItem(self, u'COCO Export', u'Masken speichern als:', [u'Polygon', u'RLE'], 0, False)
+        if not ok:
+            return
+        progress = QProgressDialog('Exportiere Annotationen', None, 0, 0, self)
+        progress.setWindowTitle('Bitte warten')
+        progress.setWindowModality(Qt.WindowModal)
+        progress.forceShow()
+
+        def step(done, total):
+            progress.setLabelText('Exportiere Annotationen {0}/{1}'.format(done, total))
+            progress.setRange(0, total)
+            progress.setValue(done)
+
+        def finished(result):
+            progress.close()
+            self.cocoExporter = None
+            if isinstance(result, Exception):
+                logging.error('COCO export to {0} failed: {1}'.format(filename, result))
+                QMessageBox.critical(self, u'Fehler', u'Export nach {0} fehlgeschlagen:\n{1}'.format(filename, result))
+                return
+            count, failed = result
+            message = u'{0} Bilder nach {1} exportiert'.format(count, filename)
+            if failed:
+                for imagePath, e in failed:
+                    logging.error('Exporting {0} failed: {1}'.format(imagePath, e))
+                # the full list is in the log, the dialog shows the first files
+                shown = [os.path.relpath(imagePath, self.dirname) for imagePath, e in failed[:20]]
+                if len(failed) > len(shown):
+                    shown.append(u'...')
+                message += u'\n\n{0} Bilder übersprungen, ihre Annotation ist nicht lesbar:\n{1}'.format(len(failed), u'\n'.join(shown))
+                QMessageBox.warning(self, u'Information', message)
+            else:
+                QMessageBox.information(self, u'Information', message)
+
+        # the export runs in a thread, the dialog stays responsive and modal
+        self.cocoExporter = CocoExporter(self)
+        self.cocoExporter.progress.connect(step)
+        self.cocoExporter.finished.connect(finished)
+        self.cocoExporter.start(self.dirname, ustr(filename), rle=mode == u'RLE')
+
     def loadRecent(self, filename, cellDetection=False):
         if not cellDetection:
             if self.dirty:
                 self.saveFile()
         self.loadFile(filename)
 
-    def scanAllImages(self, folderPath):
-        extensions = ['.jpeg', '.jpg', '.png', '.bmp']
-        images = []
-        for root, dirs, files in os.walk(folderPath):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relativePath = os.path.join(root, file)
-                    path = ustr(os.path.abspath(relativePath))
-                    images.append(path)
-        images.sort(key=lambda x: x.lower())
-        return images
+    def selectFileItem(self, filePath):
+        row = self.fileListModel.row(filePath)
+        if row is not None:
+            index = self.fileListModel.index(row, 0)
+            self.fileListWidget.setCurrentIndex(index)
+            self.fileListWidget.scrollTo(index)
+
+    def scanFound(self, paths):
+        self.fileListModel.appendImages(paths)
+        self.annotationIndex.addImages(paths)
+        if self.filePath is None:
+            # the first image is shown while the rest of the folder is scanned
+            self.loadFile(paths[0])
+
+    def scanFinished(self, images):
+        missing = [p for p in images if p not in self.fileListModel]
+        if missing:
+            self.annotationIndex.addImages(missing)
+        if images != self.mImgList:
+            # batches arrive in directory order, the list is sorted like before
+            self.fileListModel.setImages(images)
+            self.mImgList = self.fileListModel.paths()
+            if self.filePath is not None:
+                self.selectFileItem(self.filePath)
+        if self.filePath is None and self.mImgList:
+            self.loadFile(self.mImgList[0])
+
+    def waitForScan(self):
+        """Finish the scan of the opened folder before working on all of its
+        images."""
+        images = self.dirScanner.wait()
+        if images is not None:
+            self.scanFinished(images)
 
     def openDirDialog(self, _value=False, dirpath=None):
         if self.dirty:
@@ -946,15 +1314,37 @@ class MainWindow(QMainWindow, WindowMixin):
     def importDirImages(self, dirpath):
         if not self.mayContinue() or not dirpath:
             return
+        self.closeCatalog()
         self.lastOpenDir = dirpath
         self.dirname = dirpath
         self.filePath = None
-        self.fileListWidget.clear()
-        self.mImgList = self.scanAllImages(dirpath)
-        self.openNextImg()
-        for imgPath in self.mImgList:
-            item = QListWidgetItem(imgPath)
-            self.fileListWidget.addItem(item)
+        self.prefetcher.clear()
+        self.fileListModel.setImages([])
+        self.mImgList = self.fileListModel.paths()
+        self.annotationIndex.setImages([])
+        if self.catalogEnabled:
+            self.openCatalog(dirpath)
+        # the images are added to the file list in batches
+        self.dirScanner.scan(dirpath)
+
+    def openCatalog(self, dirpath):
+        """Open the catalog of a folder. The tool only stores its own
+        edits, annotations changed outside of it are picked up by the sync
+        of `python -m libs.catalog`."""
+        try:
+            self.catalog = ProjectCatalog(dirpath)
+        except sqlite3.Error as e:
+            logging.error('Opening the catalog of {0} failed: {1}'.format(dirpath, e))
+            self.catalog = None
+
+    def closeCatalog(self):
+        if self.catalog is None:
+            return
+        # saves in the background still write to the catalog
+        self.compactJournal(wait=True)
+        waitForCompactions()
+        self.catalog.close()
+        self.catalog = None
 
     def openPrevImg(self, _value=False):
         if self.autoSaving:
@@ -967,8 +1357,8 @@ class MainWindow(QMainWindow, WindowMixin):
             return
         if self.filePath is None:
             return
-        currIndex = self.mImgList.index(self.filePath)
-        if currIndex - 1 >= 0:
+        currIndex = self.fileListModel.row(self.filePath)
+        if currIndex is not None and currIndex - 1 >= 0:
             filename = self.mImgList[currIndex - 1]
             if filename:
                 self.resetOverlays()
@@ -990,8 +1380,8 @@ class MainWindow(QMainWindow, WindowMixin):
         if self.filePath is None:
             filename = self.mImgList[0]
         else:
-            currIndex = self.mImgList.index(self.filePath)
-            if currIndex + 1 < len(self.mImgList):
+            currIndex = self.fileListModel.row(self.filePath)
+            if currIndex is not None and currIndex + 1 < len(self.mImgList):
                 filename = self.mImgList[currIndex + 1]
         if filename:
             self.resetOverlays()
@@ -1011,12 +1401,11 @@ class MainWindow(QMainWindow, WindowMixin):
                 filename = filename[0]
             self.loadFile(filename)
 
+    def annotationPath(self, imagePath):
+        return os.path.splitext(imagePath)[0] + XML_EXT
+
     def saveFile(self, _value=False):
-        imgFileDir = os.path.dirname(self.filePath)
-        imgFileName = os.path.basename(self.filePath)
-        savedFileName = os.path.splitext(imgFileName)[0] + XML_EXT
-        savedPath = os.path.join(imgFileDir, savedFileName)
-        self._saveFile(savedPath)
+        self._saveFile(self.annotationPath(self.filePath))
 
     def _saveFile(self, annotationFilePath):
         if annotationFilePath and self.saveLabels(annotationFilePath):
@@ -1026,6 +1415,8 @@ class MainWindow(QMainWindow, WindowMixin):
     def closeFile(self, _value=False):
         if self.dirty:
             self.saveFile()
+        self.compactJournal(wait=True)
+        self.journal = None
         self.resetState()
         self.setClean()
         self.toggleActions(False)
@@ -1065,12 +1456,14 @@ class MainWindow(QMainWindow, WindowMixin):
 
     def deleteSelectedShape(self):
         self.toggleDrawMode(True)
-        self.remLabel(self.canvas.deleteSelected())
-        self.saveFile()
+        deleted = self.canvas.deleteSelected()
+        self.remLabel(deleted)
+        if deleted is not None:
+            self.recordUndo()
 
     def moveShape(self):
         self.canvas.endMove(copy=False)
-        self.setDirty()
+        self.recordUndo()
 
     def loadPredefinedClasses(self, predefClassesFile):
         if os.path.exists(predefClassesFile) is True:
@@ -0,0 +1,67 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from PyQt5.QtCore import QCoreApplication
+except ImportError:
+    from PyQt4.QtCore import QCoreApplication
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.annotationIndex import AnnotationIndex
+from libs.pascal_voc_io import PascalVocWriter
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+class TestAnnotationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saveDir = os.path.join(self.dir, 'labels')
+        os.mkdir(self.saveDir)
+        self.images = [os.path.join(self.dir, name + '.png') for name in ('a', 'b', 'c', 'd')]
+        for imagePath in self.images:
+            with open(imagePath, 'wb'):
+                pass
+        writer = PascalVocWriter('tests', 'a.png', (100, 100, 3))
+        writer.verified = True
+        writer.addBndBox(0, 0, 10, 10, 'zyste', [(0, 0), (10, 0), (10, 10)], 0.9, 1)
+        writer.addBndBox(20, 0, 30, 10, 'zyste', [], 0.8, 0)
+        writer.save(targetFile=os.path.join(self.saveDir, 'a.xml'))
+        # next to the image, not where the labels are read from
+        PascalVocWriter('tests', 'b.png', (100, 100, 3)).save(targetFile=os.path.join(self.dir, 'b.xml'))
+        # a bndbox that is not a number
+        with open(os.path.join(self.saveDir, 'c.xml'), 'w') as f:
+            f.write('<annotation><object><name>zyste</name><bndbox><xmin>x</xmin></bndbox></object></annotation>')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def annotationPath(self, imagePath):
+        return os.path.join(self.saveDir, os.path.basename(os.path.splitext(imagePath)[0]) + '.xml')
+
+    def test_summaries_from_the_save_dir(self):
+        index = AnnotationIndex(self.annotationPath)
+        with self.assertLogs(level='ERROR'):
+            index.setImages(self.images)
+            index.wait()
+        summary = index.get(self.images[0])
+        self.assertEqual((summary.objects, summary.verified, summary.edited), (2, True, 1))
+        for imagePath in self.images[1:]:
+            self.assertIsNone(index.get(imagePath))
+
+    def test_default_is_next_to_the_image(self):
+        index = AnnotationIndex()
+        index.setImages(self.images)
+        index.wait()
+        self.assertEqual(index.get(self.images[1]).objects, 0)
+        self.assertIsNone(index.get(self.images[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.catalog import ProjectCatalog
+from libs.pascal_voc_io import PascalVocWriter
+
+
+class TestProjectCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.images = []
+        for name, sizes in (('a', (10, 4)), ('b', (6,))):
+            imagePath = os.path.join(self.dir, name + '.png')
+            with open(imagePath, 'wb'):
+                pass
+            self.annotate(imagePath, sizes)
+            self.images.append(imagePath)
+        self.catalog = ProjectCatalog(self.dir)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dir)
+
+    def annotate(self, imagePath, sizes, mtime=None):
+        writer = PascalVocWriter('tests', os.path.basename(imagePath), (100, 100, 3))
+        for i, size in enumerate(sizes):
+            # square contour relative to the box
+            writer.addBndBox(20 * i, 0, 20 * i + size, size, 'zyste', [(0, 0), (size, 0), (size, size), (0, size)], 0.5 + 0.1 * i, 0)
+        annotationPath = os.path.splitext(imagePath)[0] + '.xml'
+        writer.save(targetFile=annotationPath)
+        if mtime is not None:
+            os.utime(annotationPath, (mtime, mtime))
+
+    def test_sync_and_query(self):
+        self.assertEqual(self.catalog.sync(), 2)
+        rows = self.catalog.query()
+        self.assertEqual([(r['path'], r['number']) for r in rows], [('a.png', 1), ('a.png', 2), ('b.png', 1)])
+        self.assertEqual([r['pixel_area'] for r in rows], [100, 16, 36])
+        self.assertEqual([r['path'] for r in self.catalog.query(minArea=20, maxArea=50)], ['b.png'])
+        self.assertEqual([r['number'] for r in self.catalog.query(minConfidence=0.55)], [2])
+        self.assertEqual(len(self.catalog.query(image='a*')), 2)
+        # nothing changed since
+        self.assertEqual(self.catalog.sync(), 0)
+
+    def test_sync_picks_up_changes(self):
+        self.catalog.sync()
+        self.annotate(self.images[1], (3, 5), mtime=time.time() + 10)
+        os.remove(os.path.splitext(self.images[0])[0] + '.xml')
+        self.assertEqual(self.catalog.sync(), 2)
+        rows = self.catalog.query()
+        self.assertEqual([(r['path'], r['pixel_area']) for r in rows], [('b.png', 9), ('b.png', 25)])
+
+    def test_unreadable_annotation_is_skipped(self):
+        with open(os.path.splitext(self.images[0])[0] + '.xml', 'w') as f:
+            f.write('<annotation><object>')
+        self.assertEqual(self.catalog.sync(), 1)
+        self.assertEqual([r['path'] for r in self.catalog.query()], ['b.png'])
+
+    def test_measurements(self):
+        shapes = [dict(label='zyste', points=[(0, 0), (8, 0), (8, 8), (0, 8)], contour_points=[(0, 0), (8, 0), (8, 8), (0, 8)],
+                       confidence=1.0, contourEdited=True, maskLabel=None)]
+        self.catalog.updateImage(self.images[0], shapes, (100, 100, 3))
+        self.assertEqual(self.catalog.query(scaled=True), [])
+        self.catalog.setMeasurements(self.images[0], {1: {'area': 16.0, 'volume': 3.0}}, 0.5)
+        rows = self.catalog.query(scaled=True, minArea=10)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['pixel_area'], rows[0]['area'], rows[0]['pixel_scale']), (64, 16.0, 0.5))
+        # new shapes drop the measurements that no longer match
+        self.catalog.updateImage(self.images[0], shapes, (100, 100, 3))
+        self.assertEqual(self.catalog.query(scaled=True), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    from pycocotools import mask as maskUtils
+except ImportError:
+    maskUtils = None
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.cocoExport import rleCounts, rleString, exportFolder
+from libs.pascal_voc_io import PascalVocWriter
+
+
+def masks():
+    """A few masks with runs across column boundaries and at both ends."""
+    rng = np.random.RandomState(0)
+    empty = np.zeros((7, 5), dtype=bool)
+    full = np.ones((7, 5), dtype=bool)
+    block = np.zeros((40, 30), dtype=bool)
+    block[5:20, 3:25] = True
+    corners = np.zeros((9, 11), dtype=bool)
+    corners[0, 0] = corners[-1, -1] = corners[0, -1] = True
+    noise = rng.rand(64, 48) > 0.7
+    # large runs need several characters per count
+    wide = np.zeros((300, 400), dtype=bool)
+    wide[:, 100:350] = True
+    return [empty, full, block, corners, noise, wide]
+
+
+@unittest.skipIf(maskUtils is None, 'pycocotools is not installed')
+class TestRle(unittest.TestCase):
+
+    def test_matches_pycocotools(self):
+        for mask in masks():
+            height, width = mask.shape
+            rr, cc = np.nonzero(mask)
+            counts = rleCounts(rr, cc, height, width)
+            self.assertEqual(sum(counts), height * width)
+            expected = maskUtils.encode(np.asfortranarray(mask.astype(np.uint8)))
+            self.assertEqual(rleString(counts), expected['counts'].decode('ascii'))
+            # and back from the uncompressed counts
+            rle = maskUtils.frPyObjects({'size': [height, width], 'counts': counts}, height, width)
+            np.testing.assert_array_equal(maskUtils.decode(rle), mask)
+
+
+class TestExportFolder(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name, boxes in (('a', 2), ('b', 0), ('c', 1)):
+            with open(os.path.join(self.dir, name + '.png'), 'wb'):
+                pass
+            writer = PascalVocWriter('tests', name + '.png', (50, 60, 3))
+            for i in range(boxes):
+                writer.addBndBox(10 * i, 5, 10 * i + 8, 15, 'zyste', [(0, 0), (0, 8), (10, 8), (10, 0)], 0.9, 0)
+            writer.save(targetFile=os.path.join(self.dir, name + '.xml'))
+        with open(os.path.join(self.dir, 'd.png'), 'wb'):
+            pass
+        with open(os.path.join(self.dir, 'd.xml'), 'w') as f:
+            f.write('<annotation><object>')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_export(self):
+        output = os.path.join(self.dir, 'coco.json')
+        for rle in (False, True):
+            count, failed = exportFolder(self.dir, output, rle=rle, jobs=2)
+            self.assertEqual(count, 3)
+            self.assertEqual([os.path.basename(p) for p, e in failed], ['d.png'])
+            with open(output) as f:
+                coco = json.load(f)
+            self.assertEqual([i['file_name'] for i in coco['images']], ['a.png', 'b.png', 'c.png'])
+            self.assertEqual([i['id'] for i in coco['images']], [1, 2, 3])
+            self.assertEqual([(a['id'], a['image_id']) for a in coco['annotations']], [(1, 1), (2, 1), (3, 3)])
+            self.assertEqual(coco['images'][0]['height'], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
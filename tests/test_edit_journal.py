@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.editJournal import EditJournal
+
+
+def shape(label, x):
+    return {'label': label, 'points': [[x, 0], [x + 5, 0], [x + 5, 5], [x, 5]]}
+
+
+class TestEditJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.annotationPath = os.path.join(self.dir, 'test.xml')
+        self.store([shape('a', 0), shape('b', 10), shape('c', 20)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, shapes):
+        # stands in for the annotation writer
+        with open(self.annotationPath, 'w') as f:
+            json.dump(shapes, f)
+
+    def stored(self):
+        with open(self.annotationPath) as f:
+            return json.load(f)
+
+    def test_replay(self):
+        journal = EditJournal(self.annotationPath)
+        journal.put(1, shape('B', 11))
+        journal.delete(0)
+        journal.put(2, shape('d', 30))
+        # a new session finds the journal of a crashed one
+        replayed = EditJournal(self.annotationPath).replay(self.stored())
+        self.assertEqual(replayed, [shape('B', 11), shape('c', 20), shape('d', 30)])
+
+    def test_torn_record(self):
+        journal = EditJournal(self.annotationPath)
+        journal.delete(0)
+        with open(journal.path, 'ab') as f:
+            f.write(b'{"op": "put", "ind')
+        replayed = EditJournal(self.annotationPath).replay(self.stored())
+        self.assertEqual(replayed, [shape('b', 10), shape('c', 20)])
+
+    def test_compact(self):
+        journal = EditJournal(self.annotationPath)
+        journal.delete(0)
+        journal.compact(lambda: self.store([shape('b', 10), shape('c', 20)]), wait=True)
+        self.assertFalse(os.path.exists(journal.path))
+        journal.delete(0)
+        replayed = EditJournal(self.annotationPath).replay(self.stored())
+        self.assertEqual(replayed, [shape('c', 20)])
+
+    def test_records_appended_while_compacting(self):
+        journal = EditJournal(self.annotationPath)
+        journal.delete(0)
+
+        def write():
+            self.store([shape('b', 10), shape('c', 20)])
+            # an edit logged while the file is written
+            journal.put(0, shape('B', 11))
+        journal.compact(write, wait=True)
+        replayed = EditJournal(self.annotationPath).replay(self.stored())
+        self.assertEqual(replayed, [shape('B', 11), shape('c', 20)])
+
+    def test_crash_between_write_and_truncate(self):
+        journal = EditJournal(self.annotationPath)
+        journal.delete(0)
+        journal.put(0, shape('B', 11))
+
+        def crash():
+            # the annotation is replaced, then the process dies before the
+            # journal is dropped
+            self.store([shape('B', 11), shape('c', 20)])
+            raise SystemExit
+        with self.assertRaises(SystemExit):
+            journal._compact(crash, journal._written)
+        self.assertTrue(os.path.exists(journal.path))
+        recovered = EditJournal(self.annotationPath)
+        self.assertIsNone(recovered.replay(self.stored()))
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertEqual(self.stored(), [shape('B', 11), shape('c', 20)])
+
+    def test_discard(self):
+        journal = EditJournal(self.annotationPath)
+        journal.delete(0)
+        journal.discard()
+        self.assertFalse(journal.hasRecords())
+        self.assertIsNone(EditJournal(self.annotationPath).replay(self.stored()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.imageBuffer import ImageBuffer
+from libs.labelFile import probeImageShape
+
+
+class TestImageBufferShape(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def saved(self, name, array, mode):
+        path = os.path.join(self.dir, name)
+        Image.fromarray(array, mode).save(path)
+        return path
+
+    def test_depth(self):
+        for name, array, mode, depth in (('gray.png', np.zeros((20, 30), np.uint8), 'L', 1),
+                                         ('rgb.png', np.zeros((20, 30, 3), np.uint8), 'RGB', 3),
+                                         ('rgba.png', np.zeros((20, 30, 4), np.uint8), 'RGBA', 3)):
+            path = self.saved(name, array, mode)
+            self.assertEqual(ImageBuffer.read(path).shape, [20, 30, depth], name)
+            # the header probe used for saves without a loaded image agrees
+            self.assertEqual(probeImageShape(path), [20, 30, depth], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
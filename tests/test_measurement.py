@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.measurement import LabelMap, labelMorphometry, polygonMorphometry, grayIntensity, labelIntensityStats
+
+
+def square(top, left, size):
+    """Contour of a square as (row, col) points."""
+    return np.array([(top, left), (top, left + size), (top + size, left + size), (top + size, left)], dtype=np.float64)
+
+
+def rectangle(top, left, height, width):
+    """Pixels of a rectangle as (rows, cols)."""
+    rr, cc = np.nonzero(np.ones((height, width), dtype=bool))
+    return rr + top, cc + left
+
+
+class TestLabelMap(unittest.TestCase):
+
+    def test_smaller_cyst_wins(self):
+        big, small = square(0, 0, 10), square(2, 2, 4)
+        labelMap = LabelMap([big, small], (20, 20))
+        r0, c0 = labelMap.origin
+        self.assertEqual(labelMap.labels[3 - r0, 3 - c0], 2)
+        self.assertEqual(labelMap.labels[8 - r0, 8 - c0], 1)
+        # raw areas are taken before the overlap is resolved
+        self.assertGreater(labelMap.rawArea[1], labelMap.rawArea[2])
+        self.assertEqual(labelMap.rawArea[1] - labelMap.rawArea[2], np.count_nonzero(labelMap.labels == 1))
+
+    def test_region_raw_area_comes_from_contour(self):
+        contour = square(0, 0, 10)
+        plain = LabelMap([contour], (20, 20))
+        # a sidecar region cut down by an overlapping detection
+        rr, cc = np.nonzero(np.ones((5, 5), dtype=bool))
+        labelMap = LabelMap([contour], (20, 20), regions={0: (rr, cc)})
+        self.assertEqual(labelMap.rawArea[1], plain.rawArea[1])
+        self.assertEqual(np.count_nonzero(labelMap.labels == 1), 25)
+
+    def test_region_without_contour(self):
+        rr, cc = np.nonzero(np.ones((3, 4), dtype=bool))
+        labelMap = LabelMap([np.zeros((0, 2))], (20, 20), regions={0: (rr, cc)})
+        self.assertEqual(labelMap.rawArea[1], 12)
+
+
+class TestLabelMorphometry(unittest.TestCase):
+
+    def test_area_and_boundary(self):
+        empty = np.zeros((0, 2))
+        regions = {0: rectangle(2, 2, 3, 4), 1: rectangle(2, 6, 3, 2), 2: rectangle(10, 10, 1, 1)}
+        labelMap = LabelMap([empty, empty, empty], (20, 20), regions)
+        area, boundary = labelMorphometry(labelMap)
+        self.assertEqual(area[1:].tolist(), [12, 6, 1])
+        # edges to the neighbouring label count for both labels
+        self.assertEqual(boundary.tolist(), [0, 14, 10, 4])
+        # the background outside the cropped label map is not counted
+        self.assertEqual(area[0], labelMap.labels.size - 19)
+
+    def test_overlap_resolved_area(self):
+        big, small = square(0, 0, 10), square(2, 2, 4)
+        labelMap = LabelMap([big, small], (20, 20))
+        area, boundary = labelMorphometry(labelMap)
+        self.assertEqual(area[2], labelMap.rawArea[2])
+        self.assertEqual(area[1], labelMap.rawArea[1] - labelMap.rawArea[2])
+        self.assertEqual(area[1:].sum(), labelMap.rawArea[1])
+        # the hole adds the boundary of the small cyst to the big one
+        self.assertEqual(boundary[1], 4 * np.sqrt(labelMap.rawArea[1]) + boundary[2])
+
+    def test_polygon_morphometry(self):
+        area, perimeter = polygonMorphometry(square(0, 0, 10))
+        self.assertEqual((area, perimeter), (100.0, 40.0))
+        area, perimeter = polygonMorphometry([(0, 0), (0, 4), (3, 0)])
+        self.assertEqual((area, perimeter), (6.0, 12.0))
+        self.assertEqual(polygonMorphometry([(0, 0), (1, 1)]), (None, None))
+
+
+class TestIntensity(unittest.TestCase):
+
+    def test_gray_intensity(self):
+        gray = np.arange(12, dtype=np.uint16).reshape(3, 4) * 1000
+        np.testing.assert_array_equal(grayIntensity(gray), gray)
+        # gray with alpha, as LA PNGs load, and a single channel
+        np.testing.assert_array_equal(grayIntensity(np.dstack((gray, np.full_like(gray, 65535)))), gray)
+        np.testing.assert_array_equal(grayIntensity(gray[..., None]), gray)
+        rgba = np.zeros((3, 4, 4), dtype=np.uint8)
+        rgba[..., 1] = 100
+        rgba[..., 3] = 255
+        np.testing.assert_allclose(grayIntensity(rgba), 71.54)
+
+    def test_label_intensity_stats(self):
+        image = np.zeros((20, 20, 2), dtype=np.uint16)
+        image[..., 0] = np.arange(20)[None, :]
+        labelMap = LabelMap([square(0, 0, 5), square(10, 10, 3)], (20, 20))
+        mean, median, std = labelIntensityStats(labelMap, image)
+        for label in (1, 2):
+            r0, c0 = labelMap.origin
+            rows, cols = np.nonzero(labelMap.labels == label)
+            values = image[rows + r0, cols + c0, 0].astype(np.float64)
+            self.assertAlmostEqual(mean[label], values.mean())
+            self.assertAlmostEqual(median[label], np.median(values))
+            self.assertAlmostEqual(std[label], values.std())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from lxml import etree
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.pascal_voc_io import PascalVocWriter, PascalVocReader, ENCODE_METHOD
+
+
+def stdlibTree(elem):
+    """Copy an lxml tree into xml.etree, as the writer used to build it."""
+    copy = ElementTree.Element(elem.tag, dict(elem.attrib))
+    copy.text = elem.text
+    for child in elem:
+        copy.append(stdlibTree(child))
+    return copy
+
+
+def oldPrettify(root):
+    # the writer before the single pass serialization
+    rough_string = ElementTree.tostring(stdlibTree(root), 'utf8')
+    root = etree.fromstring(rough_string)
+    return etree.tostring(root, pretty_print=True, encoding=ENCODE_METHOD).replace("  ".encode(), "\t".encode())
+
+
+class TestPascalVocReader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.xml')
+        writer = PascalVocWriter('tests', 'test', (512, 512, 3))
+        for i, edited in enumerate(('True', 'False', '1', '0', 'kaputt')):
+            writer.addBndBox(10 * i, 10, 10 * i + 5, 20, 'zyste', [], 0.9, edited)
+        writer.save(targetFile=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_contour_edited_literals(self):
+        shapes = PascalVocReader(self.path).getShapes()
+        self.assertEqual([s[6] for s in shapes], [True, False, True, False, False])
+
+    def test_truncated_file_has_no_shapes(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:data.rindex(b'<object>') + 20])
+        self.assertEqual(PascalVocReader(self.path).getShapes(), [])
+
+
+class TestPascalVocWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writer(self):
+        writer = PascalVocWriter('tests', 'test', (512, 512, 3), localImgPath='tests/test.png')
+        writer.verified = True
+        writer.addBndBox(60, 40, 430, 504, 'zyste', [(40, 60), (41.5, 61), (504, 430)], 0.98, 0)
+        writer.addBndBox(1, 2, 10, 20, 'zyste  doppelt\r\nleer', [], 0.5, 1, maskLabel=2)
+        writer.addBndBox(113, 40, 450, 403, u'ä niere', [], 1.0, 0)
+        return writer
+
+    def test_matches_old_writer(self):
+        writer = self.writer()
+        root = writer.genXML()
+        writer.appendObjects(root)
+        expected = oldPrettify(root)
+        target = os.path.join(self.dir, 'test.xml')
+        self.writer().save(targetFile=target)
+        with open(target, 'rb') as f:
+            written = f.read()
+        self.assertEqual(written, expected)
+        self.assertIn(b'<contour encoding="b64-int16"/>', written)
+
+    def test_read_back(self):
+        target = os.path.join(self.dir, 'test.xml')
+        self.writer().save(targetFile=target)
+        shapes = PascalVocReader(target).getShapes()
+        self.assertEqual(len(shapes), 3)
+        self.assertEqual(shapes[0][4], [(40, 60), (41.5, 61), (504, 430)])
+        self.assertEqual(len(shapes[1][4]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
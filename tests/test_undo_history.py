@@ -0,0 +1,105 @@
+import os
+import sys
+import unittest
+
+try:
+    from PyQt5.QtCore import QPointF
+except ImportError:
+    from PyQt4.QtCore import QPointF
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.shape import Shape
+from libs.undoHistory import UndoHistory, STATE_OVERHEAD
+
+
+def box(label, x, contour=((0, 0), (0, 5), (5, 5))):
+    shape = Shape(label)
+    shape.points = [QPointF(x, 0), QPointF(x + 5, 0), QPointF(x + 5, 5), QPointF(x, 5)]
+    shape.contour_points = contour
+    return shape
+
+
+def describe(shapes):
+    return [(s.label, s.points[0].x(), s.contour_points.tolist()) for s in shapes]
+
+
+class TestUndoHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.shapes = [box('a', 0), box('b', 10), box('c', 20)]
+        self.history = UndoHistory()
+        self.history.reset(self.shapes)
+
+    def test_undo_redo(self):
+        original = describe(self.shapes)
+        self.shapes[1].moveBy(QPointF(3, 0))
+        self.shapes[2].label = 'C'
+        self.history.record(self.shapes)
+        del self.shapes[0]
+        self.history.record(self.shapes)
+        self.shapes.append(box('d', 30))
+        self.history.record(self.shapes)
+        edited = describe(self.shapes)
+
+        for i in range(3):
+            self.assertIsNotNone(self.history.undo(self.shapes))
+        self.assertEqual(describe(self.shapes), original)
+        self.assertFalse(self.history.canUndo())
+        for i in range(3):
+            self.assertIsNotNone(self.history.redo(self.shapes))
+        self.assertEqual(describe(self.shapes), edited)
+        self.assertIsNone(self.history.redo(self.shapes))
+
+    def test_changes(self):
+        self.assertIsNone(self.history.record(self.shapes))
+        self.shapes[1].contour_points = [(1, 1), (1, 4), (4, 4)]
+        changes = self.history.record(self.shapes)
+        self.assertEqual(len(changes), 1)
+        shape, index, before, after = changes[0]
+        self.assertIs(shape, self.shapes[1])
+        self.assertEqual(index, 1)
+        self.assertEqual(before.contour.tolist(), [[0, 0], [0, 5], [5, 5]])
+        self.assertEqual(after.contour.tolist(), [[1, 1], [1, 4], [4, 4]])
+
+    def test_new_edit_drops_redo(self):
+        self.shapes[0].moveBy(QPointF(1, 0))
+        self.history.record(self.shapes)
+        self.history.undo(self.shapes)
+        self.shapes[0].label = 'A'
+        self.history.record(self.shapes)
+        self.assertFalse(self.history.canRedo())
+        self.history.undo(self.shapes)
+        self.assertEqual(describe(self.shapes)[0][:2], ('a', 0))
+
+    def test_merge(self):
+        for i in range(3):
+            self.shapes[0].moveBy(QPointF(1, 0))
+            self.history.record(self.shapes, merge=True)
+        self.history.undo(self.shapes)
+        self.assertEqual(self.shapes[0].points[0].x(), 0)
+        self.assertFalse(self.history.canUndo())
+
+    def test_move_shares_the_contour(self):
+        self.shapes[0].moveBy(QPointF(1, 0))
+        self.history.record(self.shapes)
+        # a moved box keeps the contour array of its previous state
+        self.assertEqual(self.history.nbytes(), STATE_OVERHEAD)
+        self.shapes[0].contour_points = [(0, 0)] * 1000
+        self.history.record(self.shapes)
+        self.assertEqual(self.history.nbytes(), 2 * STATE_OVERHEAD + 1000 * 16)
+
+    def test_memory_bound_keeps_the_last_step(self):
+        history = UndoHistory(maxBytes=1)
+        history.reset(self.shapes)
+        for x in range(1, 4):
+            self.shapes[0].moveBy(QPointF(1, 0))
+            history.record(self.shapes)
+        history.undo(self.shapes)
+        self.assertFalse(history.canUndo())
+        self.assertEqual(self.shapes[0].points[0].x(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
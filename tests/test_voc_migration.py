@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from lxml import etree
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..')
+sys.path.insert(0, libs_path)
+from libs.pascal_voc_io import PascalVocWriter, PascalVocReader, writeTree
+from libs.vocMigration import migrateFile
+
+CONTOURS = [[(40, 60), (41, 61), (50, 70)], [(1.5, 2.5), (3.0, 4.0), (5.0, 6.5)]]
+
+
+class TestVocMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.current = os.path.join(self.dir, 'current.xml')
+        self.writer().save(targetFile=self.current)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writer(self):
+        writer = PascalVocWriter('tests', 'test.png', (512, 512, 3), localImgPath='tests/test.png')
+        for i, contour in enumerate(CONTOURS):
+            writer.addBndBox(10 * i, 10 * i, 10 * i + 5, 10 * i + 5, 'zyste', contour, 0.9, 0)
+        return writer
+
+    def oldFile(self, name, texts):
+        """Annotation in the old format, contours as python literals."""
+        root = etree.parse(self.current).getroot()
+        for contour, text in zip(root.iter('contour'), texts):
+            del contour.attrib['encoding']
+            contour.text = text
+        path = os.path.join(self.dir, name)
+        writeTree(root, path)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_migrate(self):
+        path = self.oldFile('old.xml', [str(c) for c in CONTOURS])
+        self.assertEqual(migrateFile(path), (2, 0))
+        # the same file the writer produces, layout included
+        self.assertEqual(self.read(path), self.read(self.current))
+        shapes = PascalVocReader(path).getShapes()
+        self.assertEqual([s[4] for s in shapes], CONTOURS)
+        self.assertEqual(migrateFile(path), (0, 0))
+
+    def test_unreadable_contour_is_kept(self):
+        path = self.oldFile('broken.xml', ['[(1, 2), (3,', str(CONTOURS[1])])
+        self.assertEqual(migrateFile(path), (1, 1))
+        contours = list(etree.parse(path).getroot().iter('contour'))
+        self.assertIsNone(contours[0].get('encoding'))
+        self.assertEqual(contours[0].text, '[(1, 2), (3,')
+        self.assertEqual(contours[1].get('encoding'), 'b64-float32')
+
+    def test_other_xml_is_untouched(self):
+        path = os.path.join(self.dir, 'other.xml')
+        data = b'<config><contour>[(1, 2)]</contour></config>'
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.assertEqual(migrateFile(path), (0, 0))
+        self.assertEqual(self.read(path), data)
+
+
+if __name__ == '__main__':
+    unittest.main()